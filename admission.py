@@ -0,0 +1,197 @@
+import logging
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from fastapi.responses import ORJSONResponse
+
+from hashing import PASSWORD_HASH_MAX_PENDING
+from uploads import UPLOAD_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+# Peticiones a la vez en este worker; por encima se responde 503 a todas
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 256))
+# Plazas que las rutas caras no pueden ocupar: quedan para las lecturas
+# baratas (get_recipe, búsquedas...) aunque lleguen muchas peticiones caras
+ADMISSION_RESERVED_SLOTS = int(os.getenv("ADMISSION_RESERVED_SLOTS", 64))
+# Clientes distintos con cubo de tokens en memoria; se descartan los más antiguos
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", 10000))
+# Límites de ritmo por cliente, desactivados por defecto. El cliente es
+# scope["client"]: detrás del proxy solo es la IP real si uvicorn se arranca
+# con --proxy-headers --forwarded-allow-ips=<IP del proxy>; si no, todos los
+# usuarios compartirían un mismo cubo.
+ADMISSION_RATE_LIMITS = os.getenv("ADMISSION_RATE_LIMITS", "false").lower() in ("1", "true", "yes")
+
+# Rutas que nunca se rechazan
+ADMISSION_EXEMPT = {"/metrics"}
+
+BUSY_DETAIL = "Servidor ocupado, inténtalo de nuevo en unos segundos"
+RATE_LIMITED_DETAIL = "Demasiadas peticiones, inténtalo de nuevo más tarde"
+
+
+def _setting(rule: str, key: str, default: float) -> float:
+    # Por ejemplo ADMISSION_LOGIN_CONCURRENCY o ADMISSION_UPLOAD_PER_MINUTE
+    return float(os.getenv(f"ADMISSION_{rule.upper()}_{key}", default))
+
+
+class AdmissionRule:
+    """Límites de una ruta cara: concurrencia por worker y ritmo por cliente."""
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        path: str,
+        concurrency: int,
+        per_minute: float,
+        burst: int,
+        when: Optional[Callable[[Dict[str, List[str]]], bool]] = None,
+    ):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.concurrency = int(_setting(name, "CONCURRENCY", concurrency))
+        self.rate = _setting(name, "PER_MINUTE", per_minute) / 60
+        self.burst = _setting(name, "BURST", burst)
+        # Condición sobre la query string (p. ej. solo el listado sin paginar)
+        self.when = when
+        self.in_flight = 0
+        self.shed_concurrency = 0
+        self.shed_rate = 0
+
+    def matches(self, scope: dict) -> bool:
+        if scope["method"] != self.method or scope["path"] != self.path:
+            return False
+        return self.when is None or self.when(parse_qs(scope["query_string"].decode("latin-1")))
+
+
+def _scans_recipes(query: Dict[str, List[str]]) -> bool:
+    # El listado completo sin filtros sale del catálogo en memoria y es
+    # barato; solo cuentan los listados sin paginar que recorren la colección
+    if "limit" in query:
+        return False
+    if query.get("format") == ["ndjson"]:
+        return True
+    if query.get("order_by", ["id"]) != ["id"] or query.get("direction", ["asc"]) != ["asc"]:
+        return True
+    return bool(set(query) - {"view", "order_by", "direction", "format"})
+
+
+ADMISSION_RULES = [
+    # bcrypt: deja sitio en el pool de hashing para altas y cambios de
+    # contraseña, y el ritmo frena los intentos de adivinar contraseñas
+    AdmissionRule("login", "POST", "/token", PASSWORD_HASH_MAX_PENDING // 2, per_minute=10, burst=5),
+    AdmissionRule("upload", "POST", "/upload-image/", UPLOAD_CONCURRENCY * 2, per_minute=20, burst=10),
+    AdmissionRule("recipe_list", "GET", "/recipes/", 16, per_minute=60, burst=20, when=_scans_recipes),
+    AdmissionRule("tags", "GET", "/tags/", 32, per_minute=120, burst=30),
+    AdmissionRule("export", "GET", "/recipes/export", 2, per_minute=6, burst=2),
+    AdmissionRule("import", "POST", "/recipes/import", 2, per_minute=6, burst=2),
+]
+
+
+class AdmissionController:
+    """Decide si se atiende una petición o se rechaza enseguida.
+
+    Las rutas caras (ADMISSION_RULES) tienen un máximo de peticiones a la vez
+    y, con ADMISSION_RATE_LIMITS, un cubo de tokens por cliente; además no pueden ocupar las últimas
+    ADMISSION_RESERVED_SLOTS plazas del worker, que quedan para el resto.
+    Todo se guarda en memoria de cada worker.
+    """
+
+    def __init__(self, rules: List[AdmissionRule] = ADMISSION_RULES):
+        self.rules = rules
+        self.in_flight = 0
+        self.shed_overload = 0
+        # (regla, cliente) -> (tokens, instante de la última recarga)
+        self._buckets: Dict[Tuple[str, str], Tuple[float, float]] = {}
+
+    def rule_for(self, scope: dict) -> Optional[AdmissionRule]:
+        for rule in self.rules:
+            if rule.matches(scope):
+                return rule
+        return None
+
+    def take_token(self, rule: AdmissionRule, client: str) -> float:
+        """Gasta un token del cliente; devuelve 0 o los segundos hasta el siguiente."""
+        key = (rule.name, client)
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (rule.burst, now))
+        tokens = min(rule.burst, tokens + (now - last) * rule.rate)
+        if len(self._buckets) >= ADMISSION_MAX_CLIENTS:
+            # Los dict mantienen el orden de inserción: se descarta el más antiguo
+            self._buckets.pop(next(iter(self._buckets)))
+        if tokens < 1:
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rule.rate if rule.rate > 0 else 60
+        self._buckets[key] = (tokens - 1, now)
+        return 0
+
+    def stats(self) -> dict:
+        stats = {"in_flight": self.in_flight, "shed_overload": self.shed_overload, "clients": len(self._buckets)}
+        for rule in self.rules:
+            stats[f"{rule.name}_in_flight"] = rule.in_flight
+            stats[f"{rule.name}_shed_concurrency"] = rule.shed_concurrency
+            stats[f"{rule.name}_shed_rate"] = rule.shed_rate
+        return stats
+
+
+admission_controller = AdmissionController()
+
+
+def _client_id(scope: dict) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def _reject(status_code: int, detail: str, retry_after: float) -> ORJSONResponse:
+    return ORJSONResponse(
+        status_code=status_code,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI que rechaza con 429/503 antes de leer el cuerpo de la petición."""
+
+    def __init__(self, app, controller: AdmissionController = admission_controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in ADMISSION_EXEMPT:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        rule = controller.rule_for(scope)
+        response = None
+        if controller.in_flight >= ADMISSION_MAX_IN_FLIGHT:
+            controller.shed_overload += 1
+            response = _reject(503, BUSY_DETAIL, 1)
+        elif rule is not None:
+            if rule.in_flight >= rule.concurrency \
+                    or controller.in_flight >= ADMISSION_MAX_IN_FLIGHT - ADMISSION_RESERVED_SLOTS:
+                rule.shed_concurrency += 1
+                response = _reject(503, BUSY_DETAIL, 1)
+            elif ADMISSION_RATE_LIMITS:
+                wait = controller.take_token(rule, _client_id(scope))
+                if wait:
+                    rule.shed_rate += 1
+                    response = _reject(429, RATE_LIMITED_DETAIL, wait)
+        if response is not None:
+            await response(scope, receive, send)
+            return
+
+        controller.in_flight += 1
+        if rule is not None:
+            rule.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.in_flight -= 1
+            if rule is not None:
+                rule.in_flight -= 1
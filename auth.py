@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
@@ -9,11 +9,17 @@ from dotenv import load_dotenv
 import os
 from bson import ObjectId
 from database import get_database
+from hashing import hashing_executor
+from refresh_tokens import REFRESH_TOKENS_COLLECTION, hash_token, refresh_token_store
 from models.user import User, UserCreate, UserInDB
 import logging
+import random
+import time
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuración
 SECRET_KEY = os.getenv("SECRET_KEY")
 if not SECRET_KEY:
@@ -21,10 +27,20 @@ if not SECRET_KEY:
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Caché de usuarios autenticados para no consultar Mongo en cada petición
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_ENTRIES = 1024
+# Fracción de autenticaciones que se registran en el log
+AUTH_LOG_SAMPLE_RATE = float(os.getenv("AUTH_LOG_SAMPLE_RATE", 0.01))
+
 # Modelos
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class TokenData(BaseModel):
     username: Optional[str] = None
@@ -59,6 +75,14 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+# Versiones asíncronas: bcrypt se ejecuta en un pool aparte para no bloquear
+# el event loop
+async def verify_password_async(plain_password, hashed_password):
+    return await hashing_executor.run(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await hashing_executor.run(get_password_hash, password)
+
 async def get_user(username: str):
     db = get_database()
     user_dict = await db.users.find_one({"username": username})
@@ -68,11 +92,9 @@ async def get_user(username: str):
 async def authenticate_user(username: str, password: str):
     db = get_database()
     user_dict = await db["users"].find_one({"username": username})
-    print("MongoDB user data:", user_dict)  # Log para depuración
-    
     if not user_dict:
         return False
-    if not verify_password(password, user_dict["hashed_password"]):
+    if not await verify_password_async(password, user_dict["hashed_password"]):
         return False
     
     # Crear el objeto UserInDB con los campos exactos
@@ -82,8 +104,6 @@ async def authenticate_user(username: str, password: str):
         disabled=user_dict.get("disabled", False),
         hashed_password=user_dict["hashed_password"]
     )
-    
-    print("Created UserInDB object:", user.model_dump())  # Log para depuración
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -96,6 +116,68 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+ACCESS_TOKEN_TTL = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+
+async def issue_tokens(user_dict: dict, sid: Optional[str] = None) -> dict:
+    # Access token corto y refresh token opaco de la misma sesión (sid)
+    db = get_database()
+    refresh_token, sid = await refresh_token_store.issue(db, user_dict["username"], sid)
+    access_token = create_access_token(
+        data={
+            "sub": user_dict["username"],
+            "is_admin": user_dict.get("is_admin", False),
+            "sid": sid
+        },
+        expires_delta=ACCESS_TOKEN_TTL
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+async def refresh_access_token(refresh_token: str) -> dict:
+    # Sin bcrypt: el refresh token se comprueba por su sha256. El usuario se
+    # vuelve a leer para que is_admin y disabled estén al día.
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    db = get_database()
+    record = await refresh_token_store.consume(db, refresh_token, ACCESS_TOKEN_TTL)
+    if record is None:
+        raise credentials_exception
+    user_dict = await db["users"].find_one({"username": record["username"]})
+    if user_dict is None or user_dict.get("disabled", False):
+        await refresh_token_store.revoke(db, [record["sid"]], ACCESS_TOKEN_TTL)
+        raise credentials_exception
+    return await issue_tokens(user_dict, record["sid"])
+
+async def revoke_refresh_token(refresh_token: str):
+    # Cierra la sesión del token (logout); un token desconocido no es un error
+    db = get_database()
+    record = await db[REFRESH_TOKENS_COLLECTION].find_one({"_id": hash_token(refresh_token)}, {"sid": 1})
+    if record is not None:
+        await refresh_token_store.revoke(db, [record["sid"]], ACCESS_TOKEN_TTL)
+
+async def revoke_user_sessions(username: str):
+    # Llamar al borrar o desactivar un usuario, junto con invalidate_principal
+    await refresh_token_store.revoke_user(get_database(), username, ACCESS_TOKEN_TTL)
+
+_principal_cache: Dict[str, Tuple[float, "User"]] = {}
+
+def invalidate_principal(username: str):
+    # Llamar siempre que se borre o modifique un usuario en la base de datos
+    _principal_cache.pop(username, None)
+
+def _cache_principal(username: str, user: "User"):
+    if len(_principal_cache) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+        # Los dict mantienen el orden de inserción: se descarta la más antigua
+        _principal_cache.pop(next(iter(_principal_cache)))
+    _principal_cache[username] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, user)
+
+def _check_active(user: "User"):
+    # Una cuenta desactivada deja de valer aunque su token no haya caducado
+    if user.disabled:
+        raise HTTPException(status_code=400, detail="Inactive user")
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -109,22 +191,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    
+    # Sesión cerrada (logout, usuario desactivado o refresh token robado)
+    if refresh_token_store.is_revoked(payload.get("sid")):
+        raise credentials_exception
+
+    cached = _principal_cache.get(username)
+    if cached is not None and cached[0] > time.monotonic():
+        if random.random() < AUTH_LOG_SAMPLE_RATE:
+            logger.debug("Authenticated %s (cached)", username)
+        _check_active(cached[1])
+        return cached[1]
+
     db = get_database()
     user_dict = await db["users"].find_one({"username": username})
     if user_dict is None:
         raise credentials_exception
 
-    print("User dict from DB:", user_dict)  # Log para depuración
-    
     # Crear el objeto User con los campos exactos que necesitamos
     user = User(
         username=user_dict["username"],
         is_admin=user_dict.get("is_admin", False),
         disabled=user_dict.get("disabled", False)
     )
-    
-    print("Created User object:", user.model_dump())  # Log para depuración
+    _cache_principal(username, user)
+
+    if random.random() < AUTH_LOG_SAMPLE_RATE:
+        logger.debug("Authenticated %s", username)
+    _check_active(user)
     return user
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
@@ -143,7 +236,7 @@ async def create_user(user: UserCreate):
         )
     
     user_dict = user.dict()
-    user_dict["password"] = get_password_hash(user.password)
+    user_dict["password"] = await get_password_hash_async(user.password)
     user_dict["created_at"] = datetime.utcnow()
     
     result = await db.users.insert_one(user_dict)
@@ -154,6 +247,7 @@ async def create_user(user: UserCreate):
 async def delete_user(username: str):
     db = get_database()
     result = await db.users.delete_one({"username": username})
+    invalidate_principal(username)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     return {"detail": "User deleted"}
@@ -161,6 +255,8 @@ async def delete_user(username: str):
 async def is_admin(token: str = Depends(oauth2_scheme)) -> bool:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if refresh_token_store.is_revoked(payload.get("sid")):
+            return False
         is_admin = payload.get("is_admin", False)
         return is_admin
     except JWTError:
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import MONGO_MAX_POOL_SIZE, get_pool_stats
+from migrations import MIGRATIONS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Recetas leídas y escritas (bulk_write) por lote
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", 500))
+# Fracción del tiempo que el proceso puede dedicar a la migración
+BACKFILL_DUTY_CYCLE = float(os.getenv("BACKFILL_DUTY_CYCLE", 0.2))
+BACKFILL_MIN_PAUSE_SECONDS = float(os.getenv("BACKFILL_MIN_PAUSE_SECONDS", 0.05))
+# Duración del turno de un worker; si no lo renueva, otro puede continuar
+BACKFILL_LEASE_SECONDS = 60
+# Pasadas completas como máximo para recoger las recetas que se saltaron
+BACKFILL_MAX_PASSES = 3
+# Espera tras un error, que se dobla en cada fallo seguido hasta el máximo
+BACKFILL_RETRY_SECONDS = 5
+BACKFILL_MAX_RETRY_SECONDS = 300
+
+BACKFILL_ID = "backfill_recipe_metadata"
+BACKFILL_PROJECTION = {"metadata": 1, "tags": 1}
+
+# Recetas corregidas en un lote y si alguna ha cambiado de etiquetas
+BatchCallback = Callable[[List[ObjectId], bool], Awaitable[None]]
+
+METADATA_DEFAULTS = {
+    "author": "unknown",
+    "rating": None,
+    "reviews_count": 0,
+}
+
+
+def normalized_tags(tags) -> list:
+    # Etiquetas guardadas como texto separado por comas, sueltas o ausentes
+    if tags is None:
+        return []
+    if isinstance(tags, str):
+        return [tag.strip() for tag in tags.split(",") if tag.strip()]
+    if isinstance(tags, (list, tuple, set)):
+        return [tag for tag in tags if isinstance(tag, str) and tag]
+    return []
+
+
+def recipe_fix(recipe: dict) -> Optional[dict]:
+    """Campos a corregir de una receta antigua, o None si ya está completa.
+
+    Solo depende de la receta (created_at sale del ObjectId), así que las
+    lecturas anteriores al backfill ven el mismo resultado.
+    """
+    fix = {}
+    metadata = recipe.get("metadata")
+    if not isinstance(metadata, dict):
+        metadata = {}
+    created_at = recipe["_id"].generation_time.replace(tzinfo=None)
+    complete = {
+        **METADATA_DEFAULTS,
+        "created_at": created_at,
+        "updated_at": created_at,
+        **{k: v for k, v in metadata.items() if v is not None or k == "rating"},
+    }
+    complete["version"] = metadata.get("version") or 1
+    if complete != recipe.get("metadata"):
+        fix["metadata"] = complete
+    tags = normalized_tags(recipe.get("tags"))
+    if tags != recipe.get("tags"):
+        fix["tags"] = tags
+    return fix or None
+
+
+class RecipeBackfill:
+    """Completa en segundo plano la metadata y las etiquetas de recetas antiguas.
+
+    Recorre db.recetas por _id en lotes y guarda el último _id procesado en
+    la colección de migraciones, así que si el proceso se reinicia continúa
+    donde lo dejó. Solo un worker trabaja a la vez (con un turno que renueva
+    en cada lote); los demás lo reintentan y siguen ellos si el turno
+    caduca. Tras un error se reintenta con esperas crecientes. Entre lote y
+    lote descansa para no quitar más de
+    BACKFILL_DUTY_CYCLE del tiempo al tráfico normal.
+    """
+
+    def __init__(self):
+        self.owner = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+        # Hasta que termine, las lecturas y escrituras completan al vuelo las
+        # recetas a las que aún no ha llegado
+        self.done = False
+
+    def start(self, db: AsyncIOMotorDatabase, on_batch: BatchCallback):
+        self._task = asyncio.create_task(self._run(db, on_batch))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def progress(self, db: AsyncIOMotorDatabase) -> dict:
+        state = await db[MIGRATIONS_COLLECTION].find_one({"_id": BACKFILL_ID}, {"owner": 0}) or {}
+        state.pop("_id", None)
+        state.setdefault("status", "pending")
+        if state.get("last_id") is not None:
+            state["last_id"] = str(state["last_id"])
+        state["total"] = await db.recetas.estimated_document_count()
+        return state
+
+    async def _acquire(self, db: AsyncIOMotorDatabase) -> Optional[dict]:
+        now = datetime.utcnow()
+        try:
+            return await db[MIGRATIONS_COLLECTION].find_one_and_update(
+                {
+                    "_id": BACKFILL_ID,
+                    "status": {"$ne": "done"},
+                    "$or": [{"lease_until": {"$lt": now}}, {"owner": self.owner}],
+                },
+                {
+                    "$set": {"owner": self.owner, "lease_until": now + timedelta(seconds=BACKFILL_LEASE_SECONDS)},
+                    "$setOnInsert": {"status": "running", "started_at": now, "processed": 0, "updated": 0},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Terminada o en manos de otro worker
+            return None
+
+    async def _run(self, db: AsyncIOMotorDatabase, on_batch: BatchCallback):
+        # Sigue intentándolo hasta que la migración termine, aquí o en otro
+        # worker: si el que tiene el turno muere, otro lo toma al caducar
+        delay = BACKFILL_RETRY_SECONDS
+        while True:
+            try:
+                if await self._migrate(db, on_batch):
+                    return
+                delay = BACKFILL_RETRY_SECONDS
+                await asyncio.sleep(BACKFILL_LEASE_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Continuará desde el último lote guardado
+                logger.error(f"Recipe backfill failed, retrying in {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, BACKFILL_MAX_RETRY_SECONDS)
+
+    async def _migrate(self, db: AsyncIOMotorDatabase, on_batch: BatchCallback) -> bool:
+        """Procesa lotes mientras tenga el turno; True si la migración ha terminado."""
+        state = await self._acquire(db)
+        if state is None:
+            state = await db[MIGRATIONS_COLLECTION].find_one({"_id": BACKFILL_ID}, {"status": 1})
+            self.done = (state or {}).get("status") == "done"
+            return self.done
+        logger.info(f"Recipe backfill running from {state.get('last_id') or 'the start'}")
+        last_id = state.get("last_id")
+        passes, skipped = 1, 0
+        while True:
+            started = time.perf_counter()
+            query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+            batch = await db.recetas.find(query, BACKFILL_PROJECTION).sort("_id", 1).limit(
+                BACKFILL_BATCH_SIZE
+            ).to_list(length=None)
+            if not batch:
+                if not skipped or passes >= BACKFILL_MAX_PASSES:
+                    break
+                # Recetas que cambiaron entre la lectura y la escritura
+                passes, skipped, last_id = passes + 1, 0, None
+                continue
+
+            updates, ids = [], []
+            tags_changed = False
+            now = datetime.utcnow()
+            for recipe in batch:
+                fix = recipe_fix(recipe)
+                if fix:
+                    tags_changed = tags_changed or "tags" in fix
+                    # Nueva versión aunque solo cambien las etiquetas: el JSON
+                    # cacheado y el ETag dependen de ella
+                    metadata = fix.get("metadata") or recipe["metadata"]
+                    fix["metadata"] = {**metadata, "updated_at": now, "version": (metadata.get("version") or 1) + 1}
+                    # Solo si nadie la ha cambiado mientras tanto; si no,
+                    # la siguiente pasada la volverá a mirar
+                    updates.append(UpdateOne(
+                        {"_id": recipe["_id"], "metadata": recipe.get("metadata"), "tags": recipe.get("tags")},
+                        {"$set": fix},
+                    ))
+                    ids.append(recipe["_id"])
+            if updates:
+                result = await db.recetas.bulk_write(updates, ordered=False)
+                skipped += len(updates) - result.matched_count
+                await on_batch(ids, tags_changed)
+
+            last_id = batch[-1]["_id"]
+            state = await db[MIGRATIONS_COLLECTION].find_one_and_update(
+                {"_id": BACKFILL_ID, "owner": self.owner},
+                {
+                    "$set": {
+                        "last_id": last_id,
+                        "lease_until": datetime.utcnow() + timedelta(seconds=BACKFILL_LEASE_SECONDS),
+                    },
+                    "$inc": {"processed": len(batch), "updated": len(updates)},
+                },
+                return_document=ReturnDocument.AFTER,
+            )
+            if state is None:
+                logger.warning("Recipe backfill lease lost, waiting for the next turn")
+                return False
+            await asyncio.sleep(self._pause(time.perf_counter() - started))
+
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": BACKFILL_ID, "owner": self.owner},
+            {"$set": {"status": "done", "finished_at": datetime.utcnow()}}
+        )
+        self.done = True
+        logger.info(f"Recipe backfill finished: {state.get('processed', 0)} recipes, {state.get('updated', 0)} updated")
+        if skipped:
+            logger.warning(f"Recipe backfill skipped {skipped} recipes that kept changing; they are fixed when edited")
+        return True
+
+    @staticmethod
+    def _pause(elapsed: float) -> float:
+        pause = max(BACKFILL_MIN_PAUSE_SECONDS, elapsed * (1 / BACKFILL_DUTY_CYCLE - 1))
+        if get_pool_stats()["checked_out"] > MONGO_MAX_POOL_SIZE // 2:
+            # El pool de conexiones está ocupado con tráfico normal
+            pause *= 4
+        return pause
+
+
+recipe_backfill = RecipeBackfill()
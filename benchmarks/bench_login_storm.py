@@ -0,0 +1,83 @@
+"""Latencia de GET /recipes/ antes y durante una avalancha de logins.
+
+Lanza lectores continuos de /recipes/ y, pasado un periodo de referencia,
+decenas de POST /token concurrentes. Con bcrypt fuera del event loop el p99
+de las lecturas debe mantenerse; los logins que excedan la cola reciben 503.
+
+Uso: python benchmarks/bench_login_storm.py [--in-memory] [--logins 200] [--concurrency 50]
+(--in-memory necesita pip install -r requirements-dev.txt)
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from harness import latency_summary, load_app
+
+
+async def reader(client, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get("/recipes/", params={"limit": 20, "view": "card"})
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def login(client, semaphore, statuses: dict):
+    async with semaphore:
+        response = await client.post("/token", data={"username": "storm", "password": "storm-password"})
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+
+async def run(args):
+    from auth import get_password_hash
+    from benchmarks.corpus import generate_recipes
+
+    app, db = load_app(args.in_memory)
+    await db.users.delete_many({"username": "storm"})
+    await db.users.insert_one({
+        "username": "storm",
+        "hashed_password": get_password_hash("storm-password"),
+        "is_admin": False,
+        "disabled": False,
+    })
+    if await db.recetas.count_documents({}) == 0:
+        await db.recetas.insert_many([r.model_dump() | {"tags": list(r.tags)} for r in generate_recipes(500)])
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        baseline, storm = [], []
+        stop = asyncio.Event()
+        readers = [asyncio.create_task(reader(client, stop, baseline)) for _ in range(args.readers)]
+        await asyncio.sleep(args.warmup)
+        stop.set()
+        await asyncio.gather(*readers)
+
+        stop = asyncio.Event()
+        readers = [asyncio.create_task(reader(client, stop, storm)) for _ in range(args.readers)]
+        statuses = {}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        start = time.perf_counter()
+        await asyncio.gather(*(login(client, semaphore, statuses) for _ in range(args.logins)))
+        storm_seconds = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*readers)
+
+    await db.users.delete_many({"username": "storm"})
+    result = {
+        "recipes_baseline": latency_summary(baseline),
+        "recipes_during_logins": latency_summary(storm),
+        "logins": {"total": args.logins, "seconds": round(storm_seconds, 3), "statuses": statuses},
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--in-memory", action="store_true", help="usar mongomock-motor en lugar de MONGODB_URL")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--warmup", type=float, default=3.0)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,62 @@
+"""Benchmark del índice de búsqueda con corpus sintéticos.
+
+Uso: python benchmarks/bench_search.py [--sizes 10000 100000] [--queries 500]
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.corpus import DISHES, INGREDIENTS, STYLES, TAGS, generate_recipes  # noqa: E402
+from search import SearchIndex  # noqa: E402
+
+QUERY_WORDS = DISHES + INGREDIENTS + STYLES + TAGS + ["champinon", "tomates fritos", "arroces"]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(size: int, n_queries: int):
+    docs = []
+    for i, recipe in enumerate(generate_recipes(size)):
+        doc = recipe.model_dump()
+        doc["_id"] = f"{i:024x}"
+        docs.append(doc)
+
+    index = SearchIndex()
+    tracemalloc.start()
+    start = time.perf_counter()
+    for doc in docs:
+        index.add(doc)
+    build_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rng = random.Random(0)
+    latencies = []
+    for _ in range(n_queries):
+        query = " ".join(rng.sample(QUERY_WORDS, rng.randint(1, 3)))
+        start = time.perf_counter()
+        index.search(query, 20)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    print(
+        f"{size:>7} recetas | construcción {build_time:6.2f} s | memoria pico {peak / 2**20:7.1f} MiB | "
+        f"consulta p50 {statistics.median(latencies):6.2f} ms p99 {percentile(latencies, 99):6.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run(size, args.queries)
@@ -0,0 +1,71 @@
+"""Coste por receta de serializar un listado: Pydantic + json frente al camino rápido.
+
+Uso: python benchmarks/bench_serialization.py [--recipes 2000] [--rounds 5]
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from harness import ROOT  # noqa: F401  (añade la raíz del repositorio a sys.path)
+from benchmarks.corpus import generate_recipes
+from models.recipe import Recipe
+from serialization import RecipeEncoder, prepare_recipe
+
+
+def documents(count: int):
+    docs = []
+    for recipe in generate_recipes(count):
+        doc = recipe.model_dump()
+        doc["tags"] = list(doc["tags"])
+        doc["_id"] = ObjectId()
+        doc["metadata"] = {
+            "author": "unknown",
+            "created_at": datetime(2024, 1, 1),
+            "updated_at": datetime(2024, 1, 2),
+            "rating": None,
+            "reviews_count": 0,
+            "version": 1,
+        }
+        docs.append(doc)
+    return docs
+
+
+def pydantic_list(docs) -> bytes:
+    # Camino anterior: validación completa, jsonable_encoder y json estándar
+    recipes = [Recipe(**prepare_recipe(dict(doc))) for doc in docs]
+    return json.dumps(jsonable_encoder(recipes)).encode()
+
+
+def best_per_recipe_us(func, docs, rounds: int) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(docs)
+        best = min(best, time.perf_counter() - start)
+    return best / len(docs) * 1e6
+
+
+def main(args):
+    docs = documents(args.recipes)
+    results = {
+        "pydantic + json": best_per_recipe_us(pydantic_list, docs, args.rounds),
+        "rápido, caché fría": best_per_recipe_us(lambda d: RecipeEncoder().encode_list(d), docs, args.rounds),
+    }
+    warm = RecipeEncoder()
+    warm.encode_list(docs)
+    results["rápido, caché caliente"] = best_per_recipe_us(warm.encode_list, docs, args.rounds)
+
+    baseline = results["pydantic + json"]
+    for name, per_recipe in results.items():
+        print(f"{name:<24} {per_recipe:8.2f} µs/receta  (x{baseline / per_recipe:5.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipes", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,59 @@
+"""Comprueba con explain() que ningún filtro de /recipes/ recorre la colección.
+
+Ejecuta todas las combinaciones de filtros y ordenaciones contra la base de
+datos de MONGODB_URL (crea antes los índices) y termina con código 1 si algún
+plan contiene una etapa COLLSCAN.
+
+Uso: MONGODB_URL=mongodb://localhost:27017 python benchmarks/check_query_plans.py
+"""
+import asyncio
+import itertools
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import get_database  # noqa: E402
+from filters import TagMode, build_recipe_query, plan_stages  # noqa: E402
+from migrations import ensure_indexes  # noqa: E402
+from models.recipe import RecipeCategory  # noqa: E402
+from pagination import SORT_FIELDS, SortDirection, sort_spec  # noqa: E402
+
+FILTER_OPTIONS = {
+    "category": [None, [RecipeCategory.POSTRES], [RecipeCategory.PRIMEROS, RecipeCategory.SEGUNDOS]],
+    "tags": [None, ["Fácil"], ["Fácil", "Rápido"]],
+    "tag_mode": [TagMode.ALL, TagMode.ANY],
+    "cooking_time": [(None, None), (10, None), (None, 60), (15, 45)],
+    "servings": [(None, None), (2, None), (2, 4)],
+}
+
+
+def filter_combinations():
+    for category, tags, tag_mode, cooking, servings in itertools.product(*FILTER_OPTIONS.values()):
+        if tag_mode == TagMode.ANY and not tags:
+            continue
+        yield build_recipe_query(
+            category, tags, tag_mode,
+            cooking[0], cooking[1],
+            servings[0], servings[1],
+        )
+
+
+async def main() -> int:
+    db = get_database()
+    await ensure_indexes(db)
+    failures = 0
+    checked = 0
+    for query in filter_combinations():
+        for field, direction in itertools.product(SORT_FIELDS.values(), SortDirection):
+            plan = await db.recetas.find(query).sort(sort_spec(field, direction)).explain()
+            checked += 1
+            if "COLLSCAN" in plan_stages(plan.get("queryPlanner", plan)):
+                failures += 1
+                print(f"COLLSCAN: filtro={query} orden={field} {direction.value}")
+    print(f"{checked} planes comprobados, {failures} con COLLSCAN")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
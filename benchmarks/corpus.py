@@ -0,0 +1,57 @@
+import random
+from typing import Iterator
+
+from models.recipe import RecipeCategory, RecipeCreate
+
+# Vocabulario para generar recetas sintéticas en español
+INGREDIENTS = [
+    "harina", "huevos", "leche", "azúcar", "mantequilla", "aceite de oliva",
+    "ajo", "cebolla", "tomate", "pimiento rojo", "pimiento verde", "patatas",
+    "arroz", "garbanzos", "lentejas", "champiñones", "gambas", "calamares",
+    "merluza", "bacalao", "pollo", "cerdo", "ternera", "chorizo", "jamón",
+    "queso manchego", "perejil", "pimentón", "azafrán", "laurel", "limón",
+    "naranja", "almendras", "nata", "vino blanco", "caldo de pollo", "sal",
+    "pimienta negra", "calabacín", "berenjena", "espinacas", "zanahoria",
+]
+UNITS = ["g de", "kg de", "ml de", "cucharadas de", "cucharaditas de", "dientes de", ""]
+DISHES = [
+    "Tortilla", "Guiso", "Crema", "Ensalada", "Arroz", "Pisto", "Croquetas",
+    "Empanada", "Sopa", "Estofado", "Tarta", "Flan", "Asado", "Revuelto",
+]
+STYLES = [
+    "de la abuela", "al ajillo", "a la plancha", "al horno", "casero",
+    "de verano", "con verduras", "a la riojana", "gallego", "rápido",
+]
+TAGS = [
+    "Vegetariano", "Fácil", "Rápido", "Sin gluten", "Tradicional", "Picante",
+    "Económico", "Navidad", "Verano", "Para niños", "Pescado", "Carne",
+]
+VERBS = ["Picar", "Sofreír", "Añadir", "Cocer", "Hornear", "Remover", "Batir", "Servir"]
+
+
+def synthetic_recipe(rng: random.Random) -> RecipeCreate:
+    ingredients = rng.sample(INGREDIENTS, rng.randint(3, 10))
+    main_ingredient = ingredients[0]
+    return RecipeCreate(
+        title=f"{rng.choice(DISHES)} de {main_ingredient} {rng.choice(STYLES)}",
+        comment=f"Receta {rng.choice(STYLES)} para {rng.randint(2, 8)} personas",
+        description=f"Plato con {main_ingredient} y {ingredients[1]}",
+        ingredients=[
+            f"{rng.randint(1, 500)} {rng.choice(UNITS)} {item}".replace("  ", " ")
+            for item in ingredients
+        ],
+        instructions=[
+            f"{rng.choice(VERBS)} {rng.choice(ingredients)} durante {rng.randint(1, 30)} minutos"
+            for _ in range(rng.randint(3, 8))
+        ],
+        cooking_time=rng.choice([10, 15, 20, 30, 45, 60, 90, 120]),
+        servings=rng.randint(1, 8),
+        category=rng.choice(list(RecipeCategory)),
+        tags=set(rng.sample(TAGS, rng.randint(1, 4))),
+    )
+
+
+def generate_recipes(count: int, seed: int = 42) -> Iterator[RecipeCreate]:
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield synthetic_recipe(rng)
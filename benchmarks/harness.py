@@ -0,0 +1,52 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+# main.py monta public/images con una ruta relativa
+os.chdir(ROOT)
+os.environ.setdefault("SECRET_KEY", "benchmark-secret-key")
+# Nunca trabajar sobre la base de datos real por accidente
+os.environ.setdefault("DATABASE_NAME", "recetarium_bench")
+
+
+def is_bench_database(name: str) -> bool:
+    return name.endswith("_bench")
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def latency_summary(latencies_ms) -> dict:
+    return {
+        "count": len(latencies_ms),
+        "p50_ms": round(percentile(latencies_ms, 50), 3),
+        "p95_ms": round(percentile(latencies_ms, 95), 3),
+        "p99_ms": round(percentile(latencies_ms, 99), 3),
+        "max_ms": round(max(latencies_ms, default=0.0), 3),
+    }
+
+
+def load_app(in_memory: bool = False):
+    """Importa la aplicación; con in_memory usa mongomock-motor en lugar de mongod.
+
+    mongomock-motor no está en requirements.txt: se instala con
+    pip install -r requirements-dev.txt.
+    """
+    import database
+    import main
+
+    if in_memory:
+        from mongomock_motor import AsyncMongoMockClient
+
+        client = AsyncMongoMockClient()
+        db = client[database.DATABASE_NAME]
+        database.connection.client = client
+        database.database = db
+        main.db = db
+    return main.app, database.get_database()
@@ -0,0 +1,253 @@
+"""Benchmark de carga y latencia de la API.
+
+Genera un corpus sintético de recetas, arranca la aplicación contra un
+mongod local (MONGODB_URL, base de datos DATABASE_NAME=recetarium_bench por
+defecto; las recetas de esa base de datos se borran, así que con otro nombre
+que no termine en _bench hace falta --wipe) o contra mongomock-motor en memoria, y lanza cada escenario con la
+concurrencia indicada. Los resultados (rendimiento y latencias p50/p95/p99)
+se guardan en JSON para comparar ejecuciones. --in-memory necesita las
+dependencias de desarrollo (pip install -r requirements-dev.txt).
+
+Uso:
+    python benchmarks/run.py --size 10000 --concurrency 32 --output bench.json
+    python benchmarks/run.py --in-memory --size 1000 --baseline bench.json
+    python benchmarks/run.py --base-url http://localhost:8000 --scenarios list get tags
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import httpx
+
+from harness import ROOT, is_bench_database, latency_summary, load_app
+from benchmarks.corpus import generate_recipes, synthetic_recipe
+
+BENCH_USER = "bench"
+BENCH_PASSWORD = "bench-password"
+SEED_BATCH_SIZE = 1000
+
+
+class Context:
+    def __init__(self, client: httpx.AsyncClient, recipe_ids: list, token: str):
+        self.client = client
+        self.recipe_ids = recipe_ids
+        self.token = token
+        self.rng = random.Random(7)
+        # Recetas creadas por el propio benchmark, que se pueden editar y borrar
+        self.created: list = []
+
+    @property
+    def auth(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+async def scenario_list(ctx: Context):
+    return await ctx.client.get("/recipes/", params={"limit": 20, "view": "card"})
+
+
+async def scenario_list_all(ctx: Context):
+    return await ctx.client.get("/recipes/")
+
+
+async def scenario_get(ctx: Context):
+    return await ctx.client.get(f"/recipes/{ctx.rng.choice(ctx.recipe_ids)}")
+
+
+async def scenario_tags(ctx: Context):
+    return await ctx.client.get("/tags/")
+
+
+async def scenario_search(ctx: Context):
+    return await ctx.client.get("/recipes/search", params={"q": ctx.rng.choice(["tortilla", "gambas al ajillo", "arroz", "tarta de queso"])})
+
+
+async def scenario_token(ctx: Context):
+    return await ctx.client.post("/token", data={"username": BENCH_USER, "password": BENCH_PASSWORD})
+
+
+async def scenario_create(ctx: Context):
+    recipe = synthetic_recipe(ctx.rng)
+    response = await ctx.client.post("/recipes/", content=recipe.model_dump_json(), headers={**ctx.auth, "Content-Type": "application/json"})
+    if response.status_code == 200:
+        ctx.created.append(response.json()["id"])
+    return response
+
+
+async def scenario_update(ctx: Context):
+    recipe_id = ctx.rng.choice(ctx.created or ctx.recipe_ids)
+    return await ctx.client.patch(f"/recipes/{recipe_id}", json={"servings": ctx.rng.randint(1, 8)}, headers=ctx.auth)
+
+
+async def scenario_delete(ctx: Context):
+    if not ctx.created:
+        return await scenario_create(ctx)
+    return await ctx.client.delete(f"/recipes/{ctx.created.pop()}", headers=ctx.auth)
+
+
+SCENARIOS = {
+    "list": scenario_list,
+    "list_all": scenario_list_all,
+    "get": scenario_get,
+    "tags": scenario_tags,
+    "search": scenario_search,
+    "token": scenario_token,
+    "create": scenario_create,
+    "update": scenario_update,
+    "delete": scenario_delete,
+}
+DEFAULT_SCENARIOS = ["list", "get", "tags", "search", "token", "create", "update", "delete"]
+
+
+async def seed(db, size: int) -> list:
+    from auth import get_password_hash
+    from main import _new_recipe_document
+
+    await db.recetas.delete_many({})
+    batch = []
+    for recipe in generate_recipes(size):
+        batch.append(_new_recipe_document(recipe))
+        if len(batch) == SEED_BATCH_SIZE:
+            await db.recetas.insert_many(batch)
+            batch = []
+    if batch:
+        await db.recetas.insert_many(batch)
+
+    await db.users.delete_many({"username": BENCH_USER})
+    await db.users.insert_one({
+        "username": BENCH_USER,
+        "hashed_password": get_password_hash(BENCH_PASSWORD),
+        "is_admin": True,
+        "disabled": False,
+    })
+    return [str(doc["_id"]) async for doc in db.recetas.find({}, {"_id": 1})]
+
+
+async def run_scenario(ctx: Context, func, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await func(ctx)
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        **latency_summary(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"\n{'escenario':<10} {'rps':>18} {'p99 ms':>22}")
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        print(
+            f"{name:<10} {before['throughput_rps']:>8} -> {current['throughput_rps']:<8} "
+            f"{before['p99_ms']:>10} -> {current['p99_ms']:<10}"
+        )
+
+
+async def main(args):
+    if args.base_url:
+        app, db = None, None
+        transport = None
+    else:
+        app, db = load_app(args.in_memory)
+        transport = httpx.ASGITransport(app=app)
+
+    if db is not None:
+        import database
+
+        # seed() borra todas las recetas: nunca sobre la base de datos real
+        # por un DATABASE_NAME exportado en la shell o en el .env
+        if not args.in_memory and not is_bench_database(database.DATABASE_NAME) and not args.wipe:
+            raise SystemExit(
+                f"La base de datos '{database.DATABASE_NAME}' no parece de benchmarks (*_bench): "
+                "usa --wipe para borrar sus recetas de todos modos"
+            )
+        print(f"Generando {args.size} recetas...")
+        recipe_ids = await seed(db, args.size)
+        # Arrancar después de sembrar: los índices en memoria se construyen
+        # con el corpus nuevo y las tareas de fondo se lanzan una sola vez
+        await app.router.startup()
+    else:
+        recipe_ids = []
+
+    async with httpx.AsyncClient(transport=transport, base_url=args.base_url or "http://bench", timeout=60) as client:
+        if not recipe_ids:
+            response = await client.get("/recipes/", params={"limit": 200, "view": "card"})
+            recipe_ids = [recipe["id"] for recipe in response.json()]
+        token = (await client.post("/token", data={"username": BENCH_USER, "password": BENCH_PASSWORD})).json().get("access_token", "")
+        ctx = Context(client, recipe_ids, token)
+
+        results = {}
+        for name in args.scenarios:
+            results[name] = await run_scenario(ctx, SCENARIOS[name], args.requests, args.concurrency)
+            r = results[name]
+            print(f"{name:<10} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  p99 {r['p99_ms']:>8} ms  errores {r['errors']}")
+
+    if app is not None:
+        await app.router.shutdown()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "corpus_size": args.size,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "backend": args.base_url or ("in-memory" if args.in_memory else "mongod"),
+        },
+        "scenarios": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados en {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=1000, choices=[1000, 10000, 100000])
+    parser.add_argument("--in-memory", action="store_true", help="usar mongomock-motor en lugar de MONGODB_URL")
+    parser.add_argument("--base-url", help="medir un servidor ya arrancado en lugar de la app en proceso")
+    parser.add_argument("--wipe", action="store_true",
+                        help="permitir borrar las recetas de una base de datos que no termina en _bench")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=500, help="peticiones por escenario")
+    parser.add_argument("--scenarios", nargs="+", default=DEFAULT_SCENARIOS, choices=list(SCENARIOS))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON de una ejecución anterior con el que comparar")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+import logging
+import zlib
+from typing import AsyncIterator, Callable, List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from models.recipe import RecipeCreate
+
+logger = logging.getLogger(__name__)
+
+# Recetas por cada insert_many
+IMPORT_BATCH_SIZE = 500
+# Como mucho se devuelven estos errores; el resto solo se cuentan
+IMPORT_MAX_REPORTED_ERRORS = 1000
+# Longitud máxima de una línea del NDJSON
+IMPORT_MAX_LINE_BYTES = 1024 * 1024
+
+EXPORT_BATCH_SIZE = 500
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Parte en líneas un cuerpo que llega por trozos."""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > IMPORT_MAX_LINE_BYTES:
+            raise ValueError(f"Line longer than {IMPORT_MAX_LINE_BYTES} bytes")
+    if buffer:
+        yield buffer
+
+
+class ImportReport:
+    def __init__(self):
+        self.inserted = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+
+    def add_error(self, line: int, error: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line, "error": error})
+
+    def to_dict(self) -> dict:
+        return {"inserted": self.inserted, "failed": self.failed, "errors": self.errors}
+
+
+async def import_recipes(
+    db: AsyncIOMotorDatabase,
+    chunks: AsyncIterator[bytes],
+    make_document: Callable[[RecipeCreate], dict],
+    on_batch: Callable[[List[dict]], None],
+) -> ImportReport:
+    """Valida e inserta recetas en NDJSON por lotes, línea a línea.
+
+    Las líneas que no pasan la validación de RecipeCreate o que fallan al
+    insertarse se anotan en el informe con su número de línea; el resto se
+    insertan igualmente.
+    """
+    report = ImportReport()
+    batch: List[dict] = []
+    batch_lines: List[int] = []
+
+    async def flush():
+        if not batch:
+            return
+        inserted = list(batch)
+        try:
+            await db.recetas.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            failed_indexes = set()
+            for error in e.details.get("writeErrors", []):
+                failed_indexes.add(error["index"])
+                report.add_error(batch_lines[error["index"]], error.get("errmsg", "write error"))
+            inserted = [doc for i, doc in enumerate(batch) if i not in failed_indexes]
+        report.inserted += len(inserted)
+        on_batch(inserted)
+        batch.clear()
+        batch_lines.clear()
+
+    line_number = 0
+    try:
+        async for line in iter_lines(chunks):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                recipe = RecipeCreate.model_validate_json(line)
+            except ValidationError as e:
+                report.add_error(line_number, "; ".join(
+                    f"{'.'.join(str(loc) for loc in err['loc']) or 'body'}: {err['msg']}"
+                    for err in e.errors()
+                ))
+                continue
+            batch.append(make_document(recipe))
+            batch_lines.append(line_number)
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                await flush()
+    except ValueError as e:
+        report.add_error(line_number + 1, str(e))
+    await flush()
+    logger.info(f"Imported {report.inserted} recipes ({report.failed} failed)")
+    return report
+
+
+async def export_recipes(
+    db: AsyncIOMotorDatabase,
+    serialize: Callable[[dict], bytes],
+    compress: bool = False,
+) -> AsyncIterator[bytes]:
+    """Genera el NDJSON de todas las recetas, opcionalmente comprimido con gzip."""
+    # wbits=31 produce el formato gzip
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines: List[bytes] = []
+
+    def encode(data: bytes) -> bytes:
+        return compressor.compress(data) if compressor else data
+
+    async for recipe in db.recetas.find().sort("_id", 1).batch_size(EXPORT_BATCH_SIZE):
+        lines.append(serialize(recipe))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            chunk = encode(b"\n".join(lines) + b"\n")
+            lines.clear()
+            if chunk:
+                yield chunk
+    if lines:
+        chunk = encode(b"\n".join(lines) + b"\n")
+        if chunk:
+            yield chunk
+    if compressor:
+        yield compressor.flush()
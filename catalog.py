@@ -0,0 +1,303 @@
+import asyncio
+import bisect
+import gzip
+import logging
+import os
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import orjson
+from bson import ObjectId
+from fastapi import Request, Response
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+
+from models.recipe import RecipeView
+from serialization import recipe_payload
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin él se sirve gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Cada cuánto mira cada worker si otro ha cambiado el catálogo
+CATALOG_POLL_SECONDS = float(os.getenv("CATALOG_POLL_SECONDS", 1))
+# Cambios que se guardan en el documento de versión; un worker que se quede
+# más atrás recarga el catálogo entero
+CATALOG_CHANGE_LOG = int(os.getenv("CATALOG_CHANGE_LOG", 1000))
+# Cambios más grandes (p. ej. una importación) se anuncian como recarga
+# completa: el documento de versión no crece sin límite
+CATALOG_MAX_CHANGE_IDS = int(os.getenv("CATALOG_MAX_CHANGE_IDS", 1000))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+VERSION_COLLECTION = "catalog_version"
+VERSION_ID = "recetas"
+
+# Recetas cambiadas en otro worker: (id, receta actual o None si se ha
+# borrado), o None si ha habido que recargarlo todo
+RemoteChange = Callable[[Optional[List[Tuple[str, Optional[dict]]]]], Awaitable[None]]
+
+
+def _accepted_encodings(accept_encoding: Optional[str]) -> Set[str]:
+    encodings = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        if name:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+class CatalogSnapshot:
+    """Listado completo de recetas en memoria, ya codificado y comprimido.
+
+    Guarda el JSON de cada receta en cada vista y monta el cuerpo del
+    listado una vez por versión; la versión gzip (y brotli, si está
+    instalado) se genera en un hilo y mientras tanto se sirve sin comprimir.
+
+    Todos los workers comparten un contador de versión en Mongo con la lista
+    de las últimas recetas cambiadas: cada escritura lo incrementa y los
+    demás workers lo consultan cada CATALOG_POLL_SECONDS para releer solo
+    esas recetas. El ETag es esa versión, igual en todos los workers.
+    """
+
+    def __init__(self):
+        self._order: List[ObjectId] = []
+        self._encoded: Dict[RecipeView, Dict[ObjectId, bytes]] = {view: {} for view in RecipeView}
+        self.version = 0
+        # Versiones publicadas por este worker: no hace falta releerlas
+        self._own_versions: Set[int] = set()
+        # Cambia con cada receta aplicada; los cuerpos montados valen para una
+        self._generation = 0
+        # (vista, codificación) -> cuerpo de la generación self._bodies_generation
+        self._bodies: Dict[Tuple[RecipeView, str], bytes] = {}
+        self._bodies_generation = -1
+        self._compressing: Set[RecipeView] = set()
+        self._background: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.ready = False
+        self.remote_syncs = 0
+        self.full_reloads = 0
+
+    def __len__(self):
+        return len(self._order)
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        # La versión se lee antes que las recetas: un cambio que llegue
+        # mientras tanto se volverá a aplicar, nunca se perderá
+        state = await db[VERSION_COLLECTION].find_one({"_id": VERSION_ID}, {"version": 1})
+        version = (state or {}).get("version", 0)
+        order: List[ObjectId] = []
+        encoded: Dict[RecipeView, Dict[ObjectId, bytes]] = {view: {} for view in RecipeView}
+        async for recipe in db.recetas.find().sort("_id", 1):
+            order.append(recipe["_id"])
+            for view in RecipeView:
+                encoded[view][recipe["_id"]] = orjson.dumps(recipe_payload(recipe, view))
+        self._order, self._encoded = order, encoded
+        self.version = version
+        self._own_versions.clear()
+        self._generation += 1
+        self.ready = True
+        logger.info(f"Catalog snapshot built with {len(self)} recipes at version {version}")
+
+    def apply(self, recipe_id, recipe: Optional[dict]):
+        """Actualiza una receta en la copia local (None si se ha borrado)."""
+        recipe_id = ObjectId(recipe_id)
+        self._generation += 1
+        position = bisect.bisect_left(self._order, recipe_id)
+        present = position < len(self._order) and self._order[position] == recipe_id
+        if recipe is None:
+            if present:
+                del self._order[position]
+                for encoded in self._encoded.values():
+                    encoded.pop(recipe_id, None)
+            return
+        if not present:
+            self._order.insert(position, recipe_id)
+        for view, encoded in self._encoded.items():
+            encoded[recipe_id] = orjson.dumps(recipe_payload(recipe, view))
+
+    async def publish(self, db: AsyncIOMotorDatabase, recipe_ids: Iterable):
+        """Anuncia a los demás workers que estas recetas han cambiado."""
+        ids = [ObjectId(recipe_id) for recipe_id in recipe_ids]
+        if not ids:
+            return
+        # None en la lista de cambios: los demás workers recargan todo
+        change = ids if len(ids) <= CATALOG_MAX_CHANGE_IDS else None
+        async with self._lock:
+            # Versión y lista de cambios en la misma operación: la última
+            # entrada de changes corresponde a version
+            state = await db[VERSION_COLLECTION].find_one_and_update(
+                {"_id": VERSION_ID},
+                {"$inc": {"version": 1}, "$push": {"changes": {"$each": [change], "$slice": -CATALOG_CHANGE_LOG}}},
+                projection={"version": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            if state["version"] == self.version + 1:
+                self.version = state["version"]
+            else:
+                # Otro worker ha cambiado algo antes: lo aplicará sync()
+                self._own_versions.add(state["version"])
+
+    async def refresh(self, db: AsyncIOMotorDatabase, recipe_ids: Iterable) -> List[dict]:
+        """Relee de Mongo estas recetas, las aplica y las publica.
+
+        Devuelve las recetas que siguen existiendo.
+        """
+        ids = [ObjectId(recipe_id) for recipe_id in recipe_ids]
+        found = {recipe["_id"]: recipe async for recipe in db.recetas.find({"_id": {"$in": ids}})}
+        for recipe_id in ids:
+            self.apply(recipe_id, found.get(recipe_id))
+        await self.publish(db, ids)
+        return list(found.values())
+
+    async def sync(self, db: AsyncIOMotorDatabase, on_remote_change: Optional[RemoteChange] = None):
+        """Aplica los cambios publicados por otros workers desde la última versión vista."""
+        async with self._lock:
+            state = await db[VERSION_COLLECTION].find_one({"_id": VERSION_ID}, {"version": 1})
+            latest = (state or {}).get("version", 0)
+            if latest <= self.version:
+                return
+            changes = await self._changes_since(db, latest)
+            if changes is None:
+                # Demasiado atrás, o un cambio demasiado grande para listarlo
+                await self.build(db)
+                self.full_reloads += 1
+                if on_remote_change is not None:
+                    await on_remote_change(None)
+                return
+            latest = self.version + len(changes)
+
+            ids: List[ObjectId] = []
+            for version, change in enumerate(changes, start=self.version + 1):
+                if version not in self._own_versions:
+                    ids.extend(change)
+            self._own_versions = {v for v in self._own_versions if v > latest}
+            ids = list(dict.fromkeys(ids))
+            found = {}
+            if ids:
+                found = {recipe["_id"]: recipe async for recipe in db.recetas.find({"_id": {"$in": ids}})}
+                for recipe_id in ids:
+                    self.apply(recipe_id, found.get(recipe_id))
+            self.version = latest
+            self.remote_syncs += 1
+        if ids and on_remote_change is not None:
+            await on_remote_change([(str(recipe_id), found.get(recipe_id)) for recipe_id in ids])
+
+    async def _changes_since(self, db: AsyncIOMotorDatabase, latest: int) -> Optional[List[List[ObjectId]]]:
+        """Listas de ids de las versiones self.version + 1 en adelante.
+
+        Solo se descargan las entradas que faltan ($slice), no todo el
+        registro. None si hay que recargarlo todo.
+        """
+        wanted = latest - self.version
+        while wanted <= CATALOG_CHANGE_LOG:
+            state = await db[VERSION_COLLECTION].find_one(
+                {"_id": VERSION_ID}, {"version": 1, "changes": {"$slice": -wanted}}
+            )
+            changes = state.get("changes", [])
+            needed = state["version"] - self.version
+            if needed <= len(changes):
+                changes = changes[len(changes) - needed:]
+                for version, change in enumerate(changes, start=self.version + 1):
+                    if change is None and version not in self._own_versions:
+                        return None
+                return [change or [] for change in changes]
+            if len(changes) < wanted:
+                # El registro ya no llega hasta la última versión vista
+                return None
+            # Han llegado más cambios entre las dos lecturas
+            wanted = needed
+        return None
+
+    def start(self, db: AsyncIOMotorDatabase, on_remote_change: Optional[RemoteChange] = None):
+        self._task = asyncio.create_task(self._poll(db, on_remote_change))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self, db: AsyncIOMotorDatabase, on_remote_change: Optional[RemoteChange]):
+        while True:
+            await asyncio.sleep(CATALOG_POLL_SECONDS)
+            try:
+                await self.sync(db, on_remote_change)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not sync catalog snapshot: {e}")
+
+    def _identity_body(self, view: RecipeView) -> bytes:
+        if self._bodies_generation != self._generation:
+            self._bodies.clear()
+            self._bodies_generation = self._generation
+        body = self._bodies.get((view, "identity"))
+        if body is None:
+            encoded = self._encoded[view]
+            body = self._bodies[(view, "identity")] = b"[" + b",".join(encoded[i] for i in self._order) + b"]"
+        return body
+
+    def _compress_in_background(self, view: RecipeView, body: bytes):
+        if view in self._compressing:
+            return
+        self._compressing.add(view)
+        generation = self._bodies_generation
+
+        async def compress():
+            try:
+                compressed = {"gzip": await asyncio.to_thread(gzip.compress, body, GZIP_LEVEL)}
+                if brotli is not None:
+                    compressed["br"] = await asyncio.to_thread(brotli.compress, body, quality=BROTLI_QUALITY)
+                if self._bodies_generation == generation:
+                    for encoding, data in compressed.items():
+                        self._bodies[(view, encoding)] = data
+            finally:
+                self._compressing.discard(view)
+
+        task = asyncio.create_task(compress())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def response(self, request: Request, view: RecipeView) -> Response:
+        body = self._identity_body(view)
+        etag = f'"catalog-{self.version}-{view.value}"'
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+
+        accepted = _accepted_encodings(request.headers.get("accept-encoding"))
+        for encoding in ("br", "gzip"):
+            if encoding not in accepted:
+                continue
+            compressed = self._bodies.get((view, encoding))
+            if compressed is not None:
+                headers["Content-Encoding"] = encoding
+                return Response(content=compressed, media_type="application/json", headers=headers)
+        if accepted & {"br", "gzip"}:
+            self._compress_in_background(view, body)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def stats(self) -> dict:
+        return {
+            "recipes": len(self._order),
+            "version": self.version,
+            "ready": self.ready,
+            "bodies": {f"{view.value}/{encoding}": len(body) for (view, encoding), body in self._bodies.items()},
+            "remote_syncs": self.remote_syncs,
+            "full_reloads": self.full_reloads,
+            "brotli": brotli is not None,
+        }
+
+
+catalog = CatalogSnapshot()
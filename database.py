@@ -1,33 +1,181 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from dotenv import load_dotenv
+from typing import Optional
 import os
+import threading
+import time
 import logging
 from fastapi import HTTPException
 
+from metrics import command_metrics
+
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Este módulo se importa antes que main.py, así que cargamos aquí el .env
+load_dotenv()
+
 # Obtener la URL de conexión de las variables de entorno
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "recetarium")
 
-try:
-    # Crear el cliente de MongoDB
-    client = AsyncIOMotorClient(MONGODB_URL)
-    database = client[DATABASE_NAME]
-    
-    # Verificar la conexión
-    async def verify_connection():
-        try:
-            await client.admin.command('ping')
-            logger.info("Successfully connected to MongoDB")
-        except Exception as e:
-            logger.error(f"Could not connect to MongoDB: {e}")
-            raise HTTPException(status_code=500, detail="Database connection error")
+# Parámetros del pool de conexiones (por worker de uvicorn)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 50))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 10000))
+MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Estadísticas del pool a partir de los eventos CMAP de pymongo."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Motor hace las operaciones en hilos; el inicio de cada checkout se
+        # apunta por hilo para medir la espera
+        self._local = threading.local()
+        self.connections_open = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.pool_clears = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_time_avg_ms": round(1000 * self.wait_time_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_time_max_ms": round(1000 * self.wait_time_max, 3),
+                "pool_clears": self.pool_clears,
+                "max_pool_size": MONGO_MAX_POOL_SIZE,
+            }
+
+    def _wait_time(self) -> float:
+        started = getattr(self._local, "started", None)
+        self._local.started = None
+        return time.perf_counter() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        waited = self._wait_time()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def connection_check_out_failed(self, event):
+        self._wait_time()
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
 
+    def connection_ready(self, event):
+        pass
+
+
+class MongoConnection:
+    """Único cliente de MongoDB del proceso.
+
+    El cliente se crea la primera vez que se pide la base de datos, se
+    comprueba en el arranque de la aplicación y se cierra al apagarla (si se
+    vuelve a usar después, pymongo reabre las conexiones).
+    """
+
+    def __init__(self):
+        self.client: Optional[AsyncIOMotorClient] = None
+        self.pool_metrics = PoolMetrics()
+
+    def connect(self) -> AsyncIOMotorClient:
+        if self.client is None:
+            self.client = AsyncIOMotorClient(
+                MONGODB_URL,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                readPreference=MONGO_READ_PREFERENCE,
+                event_listeners=[self.pool_metrics, command_metrics],
+            )
+        return self.client
+
+    @property
+    def database(self) -> AsyncIOMotorDatabase:
+        return self.connect()[DATABASE_NAME]
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            logger.info("MongoDB connection closed")
+
+
+connection = MongoConnection()
+
+try:
+    database = connection.database
 except Exception as e:
     logger.error(f"Error initializing database connection: {e}")
     raise
 
+
+# Verificar la conexión
+async def verify_connection():
+    try:
+        await connection.connect().admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+    except Exception as e:
+        logger.error(f"Could not connect to MongoDB: {e}")
+        raise HTTPException(status_code=500, detail="Database connection error")
+
+
+async def close_connection():
+    connection.close()
+
+
+def get_pool_stats() -> dict:
+    return connection.pool_metrics.stats()
+
+
 def get_database():
-    return database
\ No newline at end of file
+    return database
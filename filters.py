@@ -0,0 +1,159 @@
+from enum import Enum
+from typing import List, Optional
+
+from fastapi import Query
+from pymongo import ASCENDING
+
+from models.recipe import RecipeCategory
+
+
+class TagMode(str, Enum):
+    ALL = "all"
+    ANY = "any"
+
+
+# Índices compuestos para los filtros y ordenaciones de /recipes/ (se crean
+# al arrancar, desde el registro de migrations.py).
+# Cada campo filtrable u ordenable encabeza al menos un índice, de modo que
+# ninguna combinación de filtros necesite recorrer la colección entera.
+RECIPE_INDEXES = [
+    [("category", ASCENDING), ("cooking_time", ASCENDING), ("servings", ASCENDING)],
+    [("tags", ASCENDING), ("category", ASCENDING), ("cooking_time", ASCENDING)],
+    [("cooking_time", ASCENDING), ("_id", ASCENDING)],
+    [("servings", ASCENDING), ("_id", ASCENDING)],
+    [("title", ASCENDING), ("_id", ASCENDING)],
+    [("metadata.created_at", ASCENDING), ("_id", ASCENDING)],
+]
+
+
+def _range(field: str, minimum: Optional[int], maximum: Optional[int]) -> dict:
+    bounds = {}
+    if minimum is not None:
+        bounds["$gte"] = minimum
+    if maximum is not None:
+        bounds["$lte"] = maximum
+    return {field: bounds} if bounds else {}
+
+
+def build_recipe_query(
+    category: Optional[List[RecipeCategory]] = None,
+    tags: Optional[List[str]] = None,
+    tag_mode: TagMode = TagMode.ALL,
+    min_cooking_time: Optional[int] = None,
+    max_cooking_time: Optional[int] = None,
+    min_servings: Optional[int] = None,
+    max_servings: Optional[int] = None,
+) -> dict:
+    query = {}
+    if category:
+        categories = [c.value for c in category]
+        query["category"] = categories[0] if len(categories) == 1 else {"$in": categories}
+    if tags:
+        query["tags"] = {"$all" if tag_mode == TagMode.ALL else "$in": tags}
+    query.update(_range("cooking_time", min_cooking_time, max_cooking_time))
+    query.update(_range("servings", min_servings, max_servings))
+    return query
+
+
+def recipe_filters(
+    category: Optional[List[RecipeCategory]] = Query(None),
+    tags: Optional[List[str]] = Query(None),
+    tag_mode: TagMode = TagMode.ALL,
+    min_cooking_time: Optional[int] = Query(None, ge=0),
+    max_cooking_time: Optional[int] = Query(None, ge=0),
+    min_servings: Optional[int] = Query(None, ge=1),
+    max_servings: Optional[int] = Query(None, ge=1),
+) -> dict:
+    # Dependencia de FastAPI: convierte los parámetros de la URL en una
+    # consulta de Mongo
+    return build_recipe_query(
+        category, tags, tag_mode,
+        min_cooking_time, max_cooking_time,
+        min_servings, max_servings,
+    )
+
+
+def merge_queries(*queries: dict) -> dict:
+    queries = [q for q in queries if q]
+    if not queries:
+        return {}
+    if len(queries) == 1:
+        return queries[0]
+    return {"$and": queries}
+
+
+def plan_stages(plan) -> List[str]:
+    # Recorre un plan de explain() y devuelve todas las etapas que contiene
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+# Límites de los tramos de tiempo de preparación (minutos) para las facetas
+COOKING_TIME_BOUNDARIES = [0, 15, 30, 60, 120]
+# Recetas con un tiempo válido; el resto (sin tiempo, nulo o negativo) se
+# cuenta aparte y no en el último tramo
+_VALID_COOKING_TIME = {"cooking_time": {"$type": "number", "$gte": 0}}
+# $group agrupa también los valores nulos o que no son texto (recetas sin
+# categoría, etiquetas antiguas); solo se devuelven los de texto
+_STRING_VALUES = {"$match": {"_id": {"$type": "string"}}}
+
+
+def facets_pipeline(query: dict) -> list:
+    # Todas las facetas en una sola agregación
+    by_count = {"$sort": {"count": -1, "_id": 1}}
+    return [
+        {"$match": query},
+        {"$facet": {
+            "total": [{"$count": "count"}],
+            "categories": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                _STRING_VALUES,
+                by_count,
+            ],
+            "tags": [
+                {"$unwind": "$tags"},
+                {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+                _STRING_VALUES,
+                by_count,
+            ],
+            "cooking_time": [
+                {"$match": _VALID_COOKING_TIME},
+                {"$bucket": {
+                    "groupBy": "$cooking_time",
+                    "boundaries": COOKING_TIME_BOUNDARIES,
+                    "default": "other",
+                    "output": {"count": {"$sum": 1}},
+                }},
+            ],
+            "cooking_time_unknown": [
+                {"$match": {"$nor": [_VALID_COOKING_TIME]}},
+                {"$count": "count"},
+            ],
+        }},
+    ]
+
+
+def parse_facets(result: dict) -> dict:
+    buckets = []
+    for bucket in result["cooking_time"]:
+        if bucket["_id"] == "other":
+            # Por encima del último límite
+            buckets.append({"min": COOKING_TIME_BOUNDARIES[-1], "max": None, "count": bucket["count"]})
+            continue
+        upper = COOKING_TIME_BOUNDARIES.index(bucket["_id"]) + 1
+        buckets.append({"min": bucket["_id"], "max": COOKING_TIME_BOUNDARIES[upper], "count": bucket["count"]})
+    return {
+        "total": result["total"][0]["count"] if result["total"] else 0,
+        "categories": [{"value": c["_id"], "count": c["count"]} for c in result["categories"]],
+        "tags": [{"value": t["_id"], "count": t["count"]} for t in result["tags"]],
+        "cooking_time": buckets,
+        "cooking_time_unknown": result["cooking_time_unknown"][0]["count"] if result["cooking_time_unknown"] else 0,
+    }
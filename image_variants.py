@@ -0,0 +1,153 @@
+import asyncio
+import hashlib
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+from fastapi.staticfiles import StaticFiles
+
+logger = logging.getLogger(__name__)
+
+IMAGES_DIR = Path("public/images/recipes")
+VARIANTS_DIR = Path("public/images/variants")
+VARIANTS_URL = "/images/variants"
+# Endpoint que genera la variante si hace falta y redirige a ella
+VARIANT_ENDPOINT = "/image-variants"
+
+# Ancho máximo de cada variante (nunca se amplía la imagen original)
+VARIANT_WIDTHS = {
+    "thumb": 160,
+    "card": 480,
+    "full": 1280,
+}
+VARIANT_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+}
+VARIANT_QUALITY = 80
+
+IMAGE_VARIANT_WORKERS = int(os.getenv("IMAGE_VARIANT_WORKERS", 2))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def _render(source: str, dest: str, width: int, fmt: str):
+    # Se ejecuta en un proceso del pool: Pillow solo se importa allí
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, width * image.height // image.width), Image.LANCZOS)
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        tmp = f"{dest}.tmp"
+        image.save(tmp, VARIANT_FORMATS[fmt], quality=VARIANT_QUALITY)
+    os.replace(tmp, dest)
+
+
+class ImageVariants:
+    """Miniaturas y versiones reducidas de las fotos de recetas.
+
+    Las variantes se guardan en public/images/variants con el hash del
+    original en el nombre, así que su URL cambia si cambia la imagen y pueden
+    servirse como inmutables.
+    """
+
+    def __init__(self, source_dir: Path = IMAGES_DIR, variants_dir: Path = VARIANTS_DIR, workers: int = IMAGE_VARIANT_WORKERS):
+        self.source_dir = source_dir
+        self.variants_dir = variants_dir
+        self.workers = workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._hashes: Dict[str, Tuple[float, int, str]] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._background: Set[asyncio.Task] = set()
+
+    def source_path(self, image_name: str) -> Optional[Path]:
+        # Solo nombres de fichero dentro de IMAGES_DIR, sin rutas
+        if Path(image_name).name != image_name:
+            return None
+        path = self.source_dir / image_name
+        return path if path.is_file() else None
+
+    def _source_hash(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self._hashes.get(path.name)
+        if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256(path.read_bytes()).hexdigest()[:12]
+        self._hashes[path.name] = (stat.st_mtime, stat.st_size, digest)
+        return digest
+
+    async def variant_name(self, source: Path, variant: str, fmt: str) -> str:
+        digest = await asyncio.to_thread(self._source_hash, source)
+        return f"{source.stem}.{variant}.{digest}.{fmt}"
+
+    async def ensure(self, source: Path, variant: str, fmt: str, force: bool = False) -> str:
+        """Genera la variante si no existe (o siempre, con force) y devuelve su URL."""
+        name = await self.variant_name(source, variant, fmt)
+        dest = self.variants_dir / name
+        if force or not dest.exists():
+            future = self._inflight.get(name)
+            if future is None:
+                self.variants_dir.mkdir(parents=True, exist_ok=True)
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                loop = asyncio.get_running_loop()
+                future = loop.run_in_executor(
+                    self._executor, _render, str(source), str(dest), VARIANT_WIDTHS[variant], fmt
+                )
+                self._inflight[name] = future
+                future.add_done_callback(lambda _: self._inflight.pop(name, None))
+            await asyncio.shield(future)
+        return f"{VARIANTS_URL}/{name}"
+
+    async def generate_all(self, source: Path, force: bool = False):
+        try:
+            await asyncio.gather(*(
+                self.ensure(source, variant, fmt, force)
+                for variant in VARIANT_WIDTHS
+                for fmt in VARIANT_FORMATS
+            ))
+        except Exception as e:
+            logger.warning(f"Could not generate variants for {source.name}: {e}")
+
+    def schedule(self, source: Path):
+        task = asyncio.create_task(self.generate_all(source))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def variant_urls(image_path: Optional[str]) -> Optional[Dict[str, str]]:
+    """URLs de las variantes de una imagen local, para elegir tamaño en el cliente.
+
+    Las imágenes externas (Cloudinary) no tienen variantes locales.
+    """
+    prefix = "/images/recipes/"
+    if not image_path or not image_path.startswith(prefix):
+        return None
+    name = image_path[len(prefix):]
+    return {
+        f"{variant}.{fmt}": f"{VARIANT_ENDPOINT}/{name}/{variant}.{fmt}"
+        for variant in VARIANT_WIDTHS
+        for fmt in VARIANT_FORMATS
+    }
+
+
+class ImageStaticFiles(StaticFiles):
+    # Las variantes llevan el hash en el nombre: se pueden cachear para siempre
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if Path(full_path).parent.name == VARIANTS_DIR.name:
+            response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+image_variants = ImageVariants()
@@ -0,0 +1,367 @@
+import bisect
+import logging
+import re
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from models.recipe import Ingredient
+from search import fold, stem, tokenize
+
+logger = logging.getLogger(__name__)
+
+# Unidades reconocidas y sus formas habituales (singular o plural)
+UNIT_ALIASES = {
+    "g": ["g", "gr", "grs", "gramo", "gramos"],
+    "kg": ["kg", "kilo", "kilos", "kilogramo", "kilogramos"],
+    "mg": ["mg", "miligramo", "miligramos"],
+    "ml": ["ml", "mililitro", "mililitros"],
+    "cl": ["cl", "centilitro", "centilitros"],
+    "dl": ["dl", "decilitro", "decilitros"],
+    "l": ["l", "litro", "litros"],
+    "cucharada": ["cucharada", "cucharadas", "cda", "cdas"],
+    "cucharadita": ["cucharadita", "cucharaditas", "cdta", "cdtas", "cdita", "cditas"],
+    "taza": ["taza", "tazas"],
+    "vaso": ["vaso", "vasos"],
+    "diente": ["diente", "dientes"],
+    "pizca": ["pizca", "pizcas", "pellizco", "pellizcos"],
+    "chorro": ["chorro", "chorros", "chorrito", "chorritos"],
+    "bandeja": ["bandeja", "bandejas"],
+    "pastilla": ["pastilla", "pastillas"],
+    "lata": ["lata", "latas"],
+    "bote": ["bote", "botes"],
+    "sobre": ["sobre", "sobres"],
+    "paquete": ["paquete", "paquetes"],
+    "loncha": ["loncha", "lonchas"],
+    "rebanada": ["rebanada", "rebanadas"],
+    "manojo": ["manojo", "manojos"],
+    "rama": ["rama", "ramas", "ramita", "ramitas"],
+    "hoja": ["hoja", "hojas"],
+    "puñado": ["puñado", "puñados"],
+    "trozo": ["trozo", "trozos"],
+    "unidad": ["unidad", "unidades"],
+}
+
+NUMBER_WORDS = {
+    "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "doce": 12,
+    "medio": 0.5, "media": 0.5, "cuarto": 0.25,
+}
+
+UNICODE_FRACTIONS = {"½": 0.5, "⅓": 1 / 3, "⅔": 2 / 3, "¼": 0.25, "¾": 0.75}
+
+# Palabras que describen la preparación y no cambian el ingrediente
+DESCRIPTORS = {
+    "picado", "fresco", "maduro", "grande", "pequeno", "mediano", "troceado",
+    "rallado", "molido", "cortado", "pelado", "laminado", "limpio", "entero",
+    "virgen", "extra", "dados", "tiras", "rodajas", "trozos", "finamente",
+    "aproximadamente", "abundante", "cocido", "congelado",
+}
+
+# Ingredientes que se dan por disponibles y no cuentan para la cobertura
+ALWAYS_AVAILABLE = {"sal", "agua"}
+
+# Unidades que se suman en la lista de la compra pasándolas a una común
+UNIT_CONVERSIONS = {
+    "kg": ("g", 1000),
+    "mg": ("g", 0.001),
+    "l": ("ml", 1000),
+    "dl": ("ml", 100),
+    "cl": ("ml", 10),
+}
+
+# Huecos en la numeración de recetas a partir de los cuales se renumera
+COMPACT_MIN_HOLES = 1024
+
+_UNITS = {stem(fold(alias)): unit for unit, aliases in UNIT_ALIASES.items() for alias in aliases}
+_DESCRIPTOR_STEMS = {stem(word) for word in DESCRIPTORS}
+_NUMBER_RE = re.compile(r"^(\d+(?:[.,]\d+)?)(?:\s*/\s*(\d+))?(?:\s*-\s*\d+(?:[.,]\d+)?)?")
+_WORD_RE = re.compile(r"^(\S+)\s*")
+_OF_RE = re.compile(r"^(?:de|del)\s+", re.IGNORECASE)
+_LEADING_NUMBER_RE = re.compile(r"^[\d\s.,/½⅓⅔¼¾-]+")
+_HALF_RE = re.compile(r"^y (?:medio|media)\b\s*", re.IGNORECASE)
+# El ingrediente termina donde empiezan las aclaraciones
+_CLAUSE_RE = re.compile(r"[,(;:]|\b(?:para|al gusto|a gusto|opcional)\b", re.IGNORECASE)
+
+
+def _parse_amount(text: str) -> Tuple[Optional[float], str]:
+    amount = None
+    while text:
+        if text[0] in UNICODE_FRACTIONS:
+            amount = (amount or 0) + UNICODE_FRACTIONS[text[0]]
+            text = text[1:].lstrip()
+            continue
+        match = _NUMBER_RE.match(text)
+        if match:
+            value = float(match.group(1).replace(",", "."))
+            if match.group(2):
+                value /= float(match.group(2)) or 1
+            # "1 1/2": la fracción se suma a la parte entera
+            amount = value if amount is None else amount + value
+            text = text[match.end():].lstrip()
+            continue
+        break
+    if amount is None:
+        match = _WORD_RE.match(text)
+        if match and fold(match.group(1)) in NUMBER_WORDS:
+            amount = NUMBER_WORDS[fold(match.group(1))]
+            text = text[match.end():]
+    return amount, text
+
+
+def _parse_unit(text: str) -> Tuple[Optional[str], str]:
+    match = _WORD_RE.match(text)
+    if match:
+        unit = _UNITS.get(stem(fold(match.group(1).rstrip("."))))
+        if unit:
+            return unit, text[match.end():]
+    return None, text
+
+
+def _add_half(amount: float, text: str) -> Tuple[float, str]:
+    # "dos y media tazas", "un kilo y medio"
+    match = _HALF_RE.match(text)
+    if match:
+        return amount + 0.5, text[match.end():]
+    return amount, text
+
+
+def _clean_item(text: str) -> str:
+    text = _CLAUSE_RE.split(text, 1)[0]
+    text = _OF_RE.sub("", text.strip())
+    return " ".join(text.lower().split())
+
+
+@lru_cache(maxsize=65536)
+def ingredient_key(item: str) -> str:
+    """Clave canónica de un ingrediente: sin acentos, plurales ni descriptores.
+
+    "Tomates maduros" -> "tomat", "aceite de oliva virgen extra" -> "aceit oliv".
+    """
+    return " ".join(token for token in tokenize(item) if token not in _DESCRIPTOR_STEMS)
+
+
+def parse_ingredient(text: str) -> Ingredient:
+    """Separa cantidad, unidad e ingrediente de una línea de texto libre.
+
+    "Dos dientes de ajo" -> amount=2, unit="diente", item="ajo". Sin cantidad
+    ("Sal al gusto") amount es None.
+    """
+    amount, rest = _parse_amount(text.strip())
+    unit = None
+    if amount is not None:
+        amount, rest = _add_half(amount, rest)
+        unit, rest = _parse_unit(rest)
+        amount, rest = _add_half(amount, rest)
+    item = _clean_item(rest) or _clean_item(text)
+    return Ingredient(item=item, amount=amount, unit=unit)
+
+
+_ALWAYS_AVAILABLE_KEYS = {ingredient_key(item) for item in ALWAYS_AVAILABLE}
+
+
+@lru_cache(maxsize=65536)
+def _keyed_item(text: str) -> Tuple[str, str]:
+    item = parse_ingredient(text).item
+    return ingredient_key(item), item
+
+
+def recipe_ingredient_keys(ingredients: Optional[Iterable[str]]) -> Dict[str, str]:
+    """Claves de los ingredientes de una receta, con el nombre que se muestra."""
+    keys: Dict[str, str] = {}
+    for text in ingredients or []:
+        if not isinstance(text, str):
+            continue
+        # La cantidad no cambia la clave: "200 g de harina" y "50 g de harina"
+        # comparten entrada en la caché
+        stripped = _LEADING_NUMBER_RE.sub("", text)
+        key, item = _keyed_item("1 " + stripped if stripped != text else text)
+        if key and key not in _ALWAYS_AVAILABLE_KEYS:
+            keys.setdefault(key, item)
+    return keys
+
+
+def build_shopping_list(recipes: Iterable[Tuple[dict, float]]) -> List[dict]:
+    """Ingredientes de varias recetas sumados por ingrediente y unidad.
+
+    Recibe pares (receta, factor por el que multiplicar las cantidades). Las
+    líneas sin cantidad ("Sal al gusto") se listan sin sumar.
+    """
+    totals: Dict[Tuple[str, Optional[str]], dict] = {}
+    for recipe, factor in recipes:
+        for text in recipe.get("ingredients") or []:
+            if not isinstance(text, str):
+                continue
+            parsed = parse_ingredient(text)
+            key = ingredient_key(parsed.item) or parsed.item
+            unit, amount = parsed.unit, parsed.amount
+            if unit in UNIT_CONVERSIONS and amount is not None:
+                unit, scale = UNIT_CONVERSIONS[unit]
+                amount *= scale
+            entry = totals.get((key, unit))
+            if entry is None:
+                entry = totals[(key, unit)] = {"item": parsed.item, "amount": None, "unit": unit, "recipes": []}
+            if amount is not None:
+                entry["amount"] = (entry["amount"] or 0) + amount * factor
+            recipe_id = str(recipe["_id"])
+            if recipe_id not in entry["recipes"]:
+                entry["recipes"].append(recipe_id)
+    for entry in totals.values():
+        if entry["amount"] is not None:
+            entry["amount"] = round(entry["amount"], 2)
+    return sorted(totals.values(), key=lambda entry: (fold(entry["item"]), entry["unit"] or ""))
+
+
+class IngredientIndex:
+    """Índice invertido ingrediente -> recetas para buscar por despensa.
+
+    Cada receta recibe un número consecutivo y las listas de cada
+    ingrediente son arrays de enteros ordenados, que ocupan poco y se
+    recorren deprisa al contar coincidencias. Las listas se separan además
+    por el número de ingredientes de la receta: dentro de cada grupo, más
+    coincidencias es más cobertura, así que basta con los más frecuentes de
+    cada grupo para ordenar sin recorrer todas las candidatas.
+    """
+
+    def __init__(self):
+        self._ordinals: Dict[str, int] = {}
+        self._ids: List[Optional[str]] = []
+        self._doc_keys: List[Optional[Tuple[str, ...]]] = []
+        # clave -> número de ingredientes de la receta -> recetas
+        self._postings: Dict[str, Dict[int, array]] = {}
+        # Primera palabra -> claves: "queso" cubre "queso manchego"
+        self._heads: Dict[str, Set[str]] = {}
+        self._names: Dict[str, str] = {}
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        self.clear()
+        async for recipe in db.recetas.find({}, {"ingredients": 1}):
+            self.add(recipe)
+        logger.info(f"Ingredient index built with {len(self)} recipes and {len(self._postings)} ingredients")
+
+    def clear(self):
+        self._ordinals.clear()
+        self._ids.clear()
+        self._doc_keys.clear()
+        self._postings.clear()
+        self._heads.clear()
+        self._names.clear()
+
+    def add(self, recipe: dict):
+        doc_id = str(recipe.get("_id", recipe.get("id")))
+        self.remove(doc_id)
+        self._insert(doc_id, recipe_ingredient_keys(recipe.get("ingredients")))
+        if len(self._ids) > 2 * len(self._ordinals) + COMPACT_MIN_HOLES:
+            self._compact()
+
+    def _insert(self, doc_id: str, keys: Dict[str, str]):
+        ordinal = len(self._ids)
+        total = len(keys)
+        self._ordinals[doc_id] = ordinal
+        self._ids.append(doc_id)
+        self._doc_keys.append(tuple(keys))
+        for key, name in keys.items():
+            groups = self._postings.get(key)
+            if groups is None:
+                groups = self._postings[key] = {}
+                self._heads.setdefault(key.split(" ", 1)[0], set()).add(key)
+                self._names[key] = name
+            # Los números nuevos siempre son los mayores: el array sigue ordenado
+            groups.setdefault(total, array("I")).append(ordinal)
+
+    def remove(self, doc_id: str):
+        ordinal = self._ordinals.pop(doc_id, None)
+        if ordinal is None:
+            return
+        keys = self._doc_keys[ordinal]
+        total = len(keys)
+        for key in keys:
+            groups = self._postings[key]
+            postings = groups[total]
+            del postings[bisect.bisect_left(postings, ordinal)]
+            if not postings:
+                del groups[total]
+            if not groups:
+                del self._postings[key]
+                del self._names[key]
+                head = key.split(" ", 1)[0]
+                self._heads[head].discard(key)
+                if not self._heads[head]:
+                    del self._heads[head]
+        self._ids[ordinal] = None
+        self._doc_keys[ordinal] = None
+
+    def _compact(self):
+        # Cada edición deja un hueco en la numeración: se renumera de vez en cuando
+        docs = [
+            (doc_id, {key: self._names[key] for key in keys})
+            for doc_id, keys in zip(self._ids, self._doc_keys)
+            if doc_id is not None
+        ]
+        self.clear()
+        for doc_id, keys in docs:
+            self._insert(doc_id, keys)
+
+    def update_many(self, recipes: Iterable[dict]):
+        for recipe in recipes:
+            self.add(recipe)
+
+    def pantry_keys(self, pantry: Iterable[str]) -> Set[str]:
+        keys = set()
+        for item in pantry:
+            key = ingredient_key(parse_ingredient(item).item)
+            if not key:
+                continue
+            if key in self._postings:
+                keys.add(key)
+            if " " not in key:
+                keys.update(self._heads.get(key, ()))
+        return keys
+
+    def match(
+        self,
+        pantry: Iterable[str],
+        limit: Optional[int] = 20,
+        min_coverage: float = 0.0,
+        max_missing: Optional[int] = None,
+    ) -> List[Tuple[str, float, int, List[str]]]:
+        """Recetas ordenadas por la parte de sus ingredientes que hay en la despensa.
+
+        Devuelve (id, cobertura, ingredientes que se tienen, nombres de los que faltan).
+        """
+        keys = self.pantry_keys(pantry)
+        counts_by_total: Dict[int, Counter] = {}
+        for key in keys:
+            for total, postings in self._postings[key].items():
+                counts_by_total.setdefault(total, Counter()).update(postings)
+
+        candidates = []
+        for total, counts in counts_by_total.items():
+            for ordinal, matched in counts.most_common(limit):
+                missing = total - matched
+                if matched < min_coverage * total or (max_missing is not None and missing > max_missing):
+                    # El resto del grupo tiene aún menos coincidencias
+                    break
+                candidates.append((-matched / total, missing, ordinal, matched))
+
+        candidates.sort()
+        if limit:
+            candidates = candidates[:limit]
+        return [
+            (
+                self._ids[ordinal],
+                -neg_coverage,
+                matched,
+                [self._names[key] for key in self._doc_keys[ordinal] if key not in keys],
+            )
+            for neg_coverage, missing, ordinal, matched in candidates
+        ]
+
+
+ingredient_index = IngredientIndex()
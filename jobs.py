@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Trabajos que ejecuta a la vez cada worker
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+# Cada cuánto se buscan trabajos encolados por otros workers o abandonados
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 5))
+# Recetas por lote en las operaciones masivas
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 500))
+# Los trabajos terminados se borran solos pasado este tiempo (índice TTL)
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", 7 * 24 * 3600))
+# Un trabajo cuyo turno no se renueva en este tiempo lo retoma otro worker
+JOB_LEASE_SECONDS = 60
+JOB_MAX_ATTEMPTS = 3
+
+JOBS_COLLECTION = "jobs"
+
+JOB_INDEXES = [
+    IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+    IndexModel([("created_at", DESCENDING)]),
+    IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=JOB_RETENTION_SECONDS),
+]
+
+
+class JobContext:
+    """Lo que recibe el handler de un trabajo: parámetros y avance."""
+
+    def __init__(self, runner: "JobRunner", db: AsyncIOMotorDatabase, job: dict):
+        self._runner = runner
+        self._db = db
+        self.id: str = job["_id"]
+        self.params: dict = job.get("params") or {}
+        self.processed: int = job.get("processed", 0)
+        self.total: Optional[int] = job.get("total")
+
+    async def progress(self, processed: int, total: Optional[int] = None):
+        """Guarda el avance y renueva el turno; falla si otro worker lo ha retomado."""
+        self.processed = processed
+        if total is not None:
+            self.total = total
+        fields = {
+            "processed": processed,
+            "lease_until": datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS),
+        }
+        if self.total is not None:
+            fields["total"] = self.total
+        result = await self._db[JOBS_COLLECTION].update_one(
+            {"_id": self.id, "owner": self._runner.owner}, {"$set": fields}
+        )
+        if result.matched_count == 0:
+            raise JobLeaseLost(self.id)
+
+
+class JobLeaseLost(Exception):
+    pass
+
+
+JobHandler = Callable[[AsyncIOMotorDatabase, JobContext], Awaitable[Optional[dict]]]
+
+
+class JobRunner:
+    """Trabajos en segundo plano persistidos en Mongo.
+
+    Cada trabajo es un documento de la colección jobs (tipo, parámetros,
+    estado y avance). Cada worker ejecuta a la vez como mucho JOB_WORKERS
+    trabajos, los que reclama de forma atómica; el turno se renueva con cada
+    avance y, si el worker muere, otro retoma el trabajo cuando caduca. Los
+    handlers trabajan por lotes y deben poder repetirse sin daño.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS):
+        self.workers = workers
+        self.owner = uuid.uuid4().hex
+        self._handlers: Dict[str, JobHandler] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, job_type: str, handler: JobHandler):
+        self._handlers[job_type] = handler
+
+    async def submit(self, db: AsyncIOMotorDatabase, job_type: str, params: Optional[dict] = None,
+                     created_by: Optional[str] = None) -> dict:
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job = {
+            "_id": uuid.uuid4().hex,
+            "type": job_type,
+            "params": params or {},
+            "status": "queued",
+            "processed": 0,
+            "total": None,
+            "attempts": 0,
+            "created_by": created_by,
+            "created_at": datetime.utcnow(),
+        }
+        await db[JOBS_COLLECTION].insert_one(job)
+        self._wakeup.set()
+        return job
+
+    async def get(self, db: AsyncIOMotorDatabase, job_id: str) -> Optional[dict]:
+        return await db[JOBS_COLLECTION].find_one({"_id": job_id}, {"owner": 0, "lease_until": 0})
+
+    async def recent(self, db: AsyncIOMotorDatabase, limit: int = 50) -> List[dict]:
+        return await db[JOBS_COLLECTION].find({}, {"owner": 0, "lease_until": 0}).sort(
+            "created_at", -1
+        ).limit(limit).to_list(length=None)
+
+    def start(self, db: AsyncIOMotorDatabase):
+        self._tasks = [asyncio.create_task(self._worker(db)) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    async def _claim(self, db: AsyncIOMotorDatabase) -> Optional[dict]:
+        now = datetime.utcnow()
+        return await db[JOBS_COLLECTION].find_one_and_update(
+            {
+                "type": {"$in": list(self._handlers)},
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_until": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "owner": self.owner,
+                    "lease_until": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _finish(self, db: AsyncIOMotorDatabase, job_id: str, fields: dict):
+        await db[JOBS_COLLECTION].update_one(
+            {"_id": job_id, "owner": self.owner},
+            {"$set": {**fields, "finished_at": datetime.utcnow()}, "$unset": {"lease_until": ""}},
+        )
+
+    async def _worker(self, db: AsyncIOMotorDatabase):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self._claim(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not claim job: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._execute(db, job)
+
+    async def _execute(self, db: AsyncIOMotorDatabase, job: dict):
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            await self._finish(db, job["_id"], {"status": "failed", "error": "Demasiados intentos"})
+            self.failed += 1
+            return
+        context = JobContext(self, db, job)
+        self.running += 1
+        try:
+            logger.info(f"Job {job['_id']} ({job['type']}) started, attempt {job['attempts']}")
+            result = await self._handlers[job["type"]](db, context)
+            await self._finish(db, job["_id"], {"status": "done", "result": result})
+            self.completed += 1
+            logger.info(f"Job {job['_id']} ({job['type']}) finished")
+        except asyncio.CancelledError:
+            # Al apagar: el trabajo queda como estaba y otro worker lo retoma
+            # cuando caduque el turno
+            raise
+        except JobLeaseLost:
+            logger.warning(f"Job {job['_id']} lease lost, stopping")
+        except Exception as e:
+            logger.error(f"Job {job['_id']} ({job['type']}) failed: {e}")
+            self.failed += 1
+            await self._finish(db, job["_id"], {"status": "failed", "error": str(e)})
+        finally:
+            self.running -= 1
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+job_runner = JobRunner()
@@ -1,41 +1,98 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, status
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends, Header, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from datetime import datetime, timedelta
-from models.recipe import Recipe, RecipeCreate
+from fastapi.responses import ORJSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
+from datetime import datetime
+from models.recipe import (
+    Recipe,
+    RecipeCreate,
+    RecipeBatch,
+    RecipeBatchRequest,
+    RecipeFacets,
+    RecipeMatch,
+    RecipeUpdate,
+    RecipeView,
+    TagCount,
+    TagMerge,
+    TagRename,
+)
 from bson import ObjectId
-from typing import List
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from typing import Dict, List, Literal, Optional, Union
+import orjson
 import shutil
 import os
 from pathlib import Path
 import uuid
-from fastapi.staticfiles import StaticFiles
 import cloudinary
-import cloudinary.uploader
 from dotenv import load_dotenv
 from fastapi.security import OAuth2PasswordRequestForm
 from auth import (
     Token,
     User,
     authenticate_user,
-    create_access_token,
     get_current_active_user,
     get_current_user,
     fake_users_db,
     UserInDB,
     create_user,
     delete_user,
-    ACCESS_TOKEN_EXPIRE_MINUTES,
-    get_password_hash,
+    get_password_hash_async,
     admin_required,
-    verify_password
+    invalidate_principal,
+    issue_tokens,
+    refresh_access_token,
+    revoke_refresh_token,
+    revoke_user_sessions,
+    RefreshRequest,
+    verify_password_async
+)
+from database import close_connection, get_database, get_pool_stats, verify_connection
+from bulk import export_recipes, import_recipes
+from admission import AdmissionMiddleware, admission_controller
+from backfill import recipe_backfill, recipe_fix
+from catalog import catalog
+from hashing import hashing_executor
+from image_variants import (
+    VARIANT_ENDPOINT,
+    VARIANT_FORMATS,
+    VARIANT_WIDTHS,
+    ImageStaticFiles,
+    image_variants,
+)
+from ingredients import build_shopping_list, ingredient_index
+from jobs import JOB_BATCH_SIZE, JobContext, job_runner
+from filters import facets_pipeline, merge_queries, parse_facets, recipe_filters
+from metrics import MetricsMiddleware, render_metrics
+from migrations import ensure_indexes, index_usage_report, run_migrations
+from pagination import (
+    MAX_PAGE_SIZE,
+    SORT_FIELDS,
+    SortDirection,
+    SortKey,
+    encode_cursor,
+    keyset_filter,
+    sort_spec,
 )
-from database import get_database, verify_connection
-from models.user import UserCreate
+from refresh_tokens import refresh_token_store
+from related import RELATED_NEIGHBOURS, related_index
+from response_cache import response_cache
+from search import search_index
+from serialization import prepare_recipe, recipe_encoder
+from tag_index import tag_index
+from uploads import upload_pipeline
+from versioning import expected_version, metadata_now, recipe_etag, recipe_version, version_filter
+from models.user import UserCreate, UserUpdate
 import logging
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
-app = FastAPI()
+# orjson para todas las respuestas JSON
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Límites de las rutas caras (login, subidas, listados completos); va por
+# dentro de CORS y de las métricas para que los 429/503 pasen por ambos
+app.add_middleware(AdmissionMiddleware)
 
 # Configurar CORS
 app.add_middleware(
@@ -52,18 +109,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# MongoDB connection
-# MONGODB_URL = "mongodb://localhost:27017"
-MONGODB_URL = os.getenv("MONGODB_URL")
-client = AsyncIOMotorClient(MONGODB_URL)
-db = client.recetarium
+# Latencia por ruta y consultas a Mongo por petición, publicadas en /metrics
+app.add_middleware(MetricsMiddleware)
+
+# MongoDB connection: el cliente compartido de database.py
+db = get_database()
 
 # Configurar la ruta para las imágenes
 IMAGES_DIR = Path("public/images/recipes")
 IMAGES_DIR.mkdir(parents=True, exist_ok=True)
 
 # Montar el directorio de imágenes
-app.mount("/images", StaticFiles(directory="public/images"), name="images")
+app.mount("/images", ImageStaticFiles(directory="public/images"), name="images")
 
 # Configuración de Cloudinary (añade esto después de la configuración de FastAPI)
 load_dotenv()
@@ -76,6 +133,80 @@ cloudinary.config(
 @app.on_event("startup")
 async def startup_db_client():
     await verify_connection()
+    # Índices declarados, migraciones pendientes e informe de uso de índices
+    await run_migrations(db)
+    await tag_index.rebuild(db)
+    await search_index.build(db)
+    await ingredient_index.build(db)
+    await catalog.build(db)
+    # La tabla de recetas relacionadas se calcula en segundo plano
+    related_index.start(db)
+    # Cambios hechos por otros workers
+    catalog.start(db, _on_remote_change)
+    # Metadata y etiquetas de las recetas antiguas, en segundo plano
+    recipe_backfill.start(db, _on_recipes_backfilled)
+    # Operaciones masivas de administración (etiquetas, imágenes, índices)
+    job_runner.start(db)
+    # Sesiones revocadas en cualquier worker
+    refresh_token_store.start(db)
+
+@app.on_event("shutdown")
+async def shutdown_app():
+    await refresh_token_store.stop()
+    await job_runner.stop()
+    await recipe_backfill.stop()
+    await catalog.stop()
+    await related_index.stop()
+    hashing_executor.shutdown()
+    image_variants.shutdown()
+    await close_connection()
+
+async def _on_recipe_write(old_recipe: Optional[dict], new_recipe: Optional[dict]):
+    # Mantener al día los índices en memoria tras crear, editar o borrar
+    await tag_index.apply_change(
+        db,
+        old_recipe.get("tags") if old_recipe else None,
+        new_recipe.get("tags") if new_recipe else None
+    )
+    if new_recipe is None:
+        search_index.remove(str(old_recipe["_id"]))
+        ingredient_index.remove(str(old_recipe["_id"]))
+        related_index.remove(str(old_recipe["_id"]))
+    else:
+        search_index.add(new_recipe)
+        ingredient_index.add(new_recipe)
+        related_index.add(new_recipe)
+    response_cache.invalidate()
+    recipe_id = (new_recipe or old_recipe)["_id"]
+    catalog.apply(recipe_id, new_recipe)
+    await catalog.publish(db, [recipe_id])
+
+async def _on_recipes_backfilled(recipe_ids: List[ObjectId], tags_changed: bool):
+    recipes = await catalog.refresh(db, recipe_ids)
+    if tags_changed:
+        search_index.update_many(recipes)
+        related_index.update_many(recipes)
+        await tag_index.rebuild(db)
+    response_cache.invalidate()
+
+async def _on_remote_change(changes: Optional[List[tuple]]):
+    # Otro worker ha cambiado recetas: poner al día los índices de este
+    if changes is None:
+        await search_index.build(db)
+        await ingredient_index.build(db)
+        related_index.request_rebuild()
+    else:
+        for recipe_id, recipe in changes:
+            if recipe is None:
+                search_index.remove(recipe_id)
+                ingredient_index.remove(recipe_id)
+                related_index.remove(recipe_id)
+            else:
+                search_index.add(recipe)
+                ingredient_index.add(recipe)
+                related_index.add(recipe)
+    response_cache.invalidate()
+    await tag_index.reload(db)
 
 @app.post("/token")
 async def login_for_access_token(
@@ -84,25 +215,27 @@ async def login_for_access_token(
     db = get_database()
     user_dict = await db["users"].find_one({"username": form_data.username})
     
-    if not user_dict or not verify_password(form_data.password, user_dict["hashed_password"]):
+    if not user_dict or not await verify_password_async(form_data.password, user_dict["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={
-            "sub": user_dict["username"],
-            "is_admin": user_dict.get("is_admin", False)
-        },
-        expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    return await issue_tokens(user_dict)
 
-@app.post("/recipes/", response_model=Recipe)
-async def create_recipe(recipe: RecipeCreate, current_user: User = Depends(get_current_user)):
+@app.post("/token/refresh", response_model=Token)
+async def refresh_token(body: RefreshRequest):
+    # Nuevo access token (y nuevo refresh token) sin volver a pedir la contraseña
+    return await refresh_access_token(body.refresh_token)
+
+@app.post("/token/revoke")
+async def revoke_token(body: RefreshRequest):
+    # Cierre de sesión: el refresh token y los access tokens de la sesión dejan de valer
+    await revoke_refresh_token(body.refresh_token)
+    return {"message": "Sesión cerrada"}
+
+def _new_recipe_document(recipe: RecipeCreate) -> dict:
     recipe_dict = recipe.dict()
     
     # Convertir el conjunto de tags en una lista
@@ -110,55 +243,387 @@ async def create_recipe(recipe: RecipeCreate, current_user: User = Depends(get_c
         recipe_dict["tags"] = list(recipe_dict["tags"])
     
     # Añadir metadata
+    now = metadata_now()
     recipe_dict["metadata"] = {
         "author": "unknown",
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
+        "created_at": now,
+        "updated_at": now,
         "rating": None,
-        "reviews_count": 0
+        "reviews_count": 0,
+        "version": 1
     }
+    return recipe_dict
+
+@app.post("/recipes/", response_model=Recipe)
+async def create_recipe(recipe: RecipeCreate, response: Response, current_user: User = Depends(get_current_user)):
+    recipe_dict = _new_recipe_document(recipe)
     
-    result = await db.recetas.insert_one(recipe_dict)
-    created_recipe = await db.recetas.find_one({"_id": result.inserted_id})
-    created_recipe["id"] = str(created_recipe.pop("_id"))
-    return Recipe(**created_recipe)
+    # insert_one añade el _id al diccionario: no hace falta volver a leerla
+    await db.recetas.insert_one(recipe_dict)
+    await _on_recipe_write(None, recipe_dict)
+    response.headers["ETag"] = recipe_etag(recipe_dict)
+    return Recipe(**prepare_recipe(dict(recipe_dict)))
+
+# Proyecciones de Mongo para cada vista del listado
+VIEW_PROJECTIONS = {
+    RecipeView.FULL: None,
+    RecipeView.CARD: {"ingredients": 0, "instructions": 0},
+}
+
+# Recetas como máximo en una petición a /recipes/batch
+MAX_BATCH_SIZE = 100
 
 @app.get("/recipes/", response_model=List[Recipe])
-async def get_recipes():
-    recipes = []
-    async for recipe in db.recetas.find():
-        recipe["id"] = str(recipe.pop("_id"))
-        # Añadir metadata por defecto si no existe
-        if "metadata" not in recipe:
-            recipe["metadata"] = {
-                "author": "unknown",
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "rating": None,
-                "reviews_count": 0
-            }
-        recipes.append(Recipe(**recipe))
-    return recipes
+async def get_recipes(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    order_by: SortKey = SortKey.ID,
+    direction: SortDirection = SortDirection.ASC,
+    view: RecipeView = RecipeView.FULL,
+    output: Literal["json", "ndjson"] = Query("json", alias="format"),
+    filters: dict = Depends(recipe_filters),
+):
+    # Paginación por cursor (keyset): el cliente pasa en `after` el cursor
+    # devuelto en la cabecera X-Next-Cursor de la página anterior.
+    # Sin `limit` se devuelven todas las recetas, como antes.
+    streaming = output == "ndjson" or "application/x-ndjson" in request.headers.get("accept", "")
+    if (catalog.ready and not streaming and not filters and limit is None and after is None
+            and order_by == SortKey.ID and direction == SortDirection.ASC):
+        # El listado completo sale de la copia en memoria, ya codificado y comprimido
+        return catalog.response(request, view)
+    if not streaming:
+        cached = response_cache.get(request)
+        if cached is not None:
+            return cached
+
+    field = SORT_FIELDS[order_by]
+    cursor = db.recetas.find(
+        merge_queries(filters, keyset_filter(field, direction, after)),
+        VIEW_PROJECTIONS[view],
+    ).sort(sort_spec(field, direction))
+    if limit:
+        # Pedimos uno más para saber si hay página siguiente
+        cursor = cursor.limit(limit + 1)
+
+    if streaming:
+        async def stream_recipes():
+            sent = 0
+            async for recipe in cursor:
+                if limit and sent == limit:
+                    break
+                sent += 1
+                yield recipe_encoder.encode(recipe, view) + b"\n"
+
+        return StreamingResponse(stream_recipes(), media_type="application/x-ndjson")
+
+    docs = await cursor.to_list(length=None)
+    headers = {}
+    if limit and len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1], field)
+        next_url = request.url.include_query_params(after=next_cursor)
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{next_url}>; rel="next"'
+
+    # Documentos propios: se serializan sin volver a validarlos con Pydantic
+    content = recipe_encoder.encode_list(docs, view)
+    return response_cache.put(request, Response(content=content, media_type="application/json", headers=headers))
+
+def _on_recipes_imported(recipes: List[dict]):
+    search_index.update_many(recipes)
+    ingredient_index.update_many(recipes)
+    related_index.update_many(recipes)
+    for recipe in recipes:
+        catalog.apply(recipe["_id"], recipe)
+
+@app.post("/recipes/import")
+async def import_recipes_ndjson(request: Request, current_user: User = Depends(get_current_user)):
+    # Cuerpo en NDJSON: una receta (RecipeCreate) por línea. Se valida e
+    # inserta por lotes según llega y se informa de los errores por línea.
+    imported = []
+
+    def on_batch(recipes: List[dict]):
+        _on_recipes_imported(recipes)
+        imported.extend(recipe["_id"] for recipe in recipes)
+
+    report = await import_recipes(db, request.stream(), _new_recipe_document, on_batch)
+    if report.inserted:
+        await tag_index.rebuild(db)
+        response_cache.invalidate()
+        await catalog.publish(db, imported)
+    return report.to_dict()
+
+@app.get("/recipes/export")
+async def export_recipes_ndjson(gzip: bool = False):
+    # Todas las recetas en NDJSON, sin cargarlas en memoria de golpe
+    filename = "recetas.ndjson.gz" if gzip else "recetas.ndjson"
+    return StreamingResponse(
+        export_recipes(
+            db,
+            recipe_encoder.encode,
+            compress=gzip
+        ),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/recipes/facets", response_model=RecipeFacets)
+async def get_recipe_facets(request: Request, filters: dict = Depends(recipe_filters)):
+    # Recuentos por categoría, etiqueta y tiempo de preparación en una sola
+    # agregación, con los mismos filtros que /recipes/; se guarda en la caché
+    # de respuestas hasta la siguiente escritura
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    result = await db.recetas.aggregate(facets_pipeline(filters)).to_list(length=1)
+    facets = RecipeFacets(**parse_facets(result[0]))
+    return response_cache.put(request, ORJSONResponse(content=jsonable_encoder(facets)))
+
+@app.get("/recipes/search", response_model=List[Recipe])
+async def search_recipes(
+    request: Request,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    view: RecipeView = RecipeView.FULL,
+):
+    # Búsqueda de texto completo sin acentos, ordenada por relevancia (BM25)
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    ranked = search_index.search(q, limit)
+    if not ranked:
+        return response_cache.put(request, ORJSONResponse(content=[]))
+
+    found = {}
+    ids = [ObjectId(recipe_id) for recipe_id, _ in ranked]
+    async for recipe in db.recetas.find({"_id": {"$in": ids}}, VIEW_PROJECTIONS[view]):
+        found[str(recipe["_id"])] = recipe
+
+    content = recipe_encoder.encode_list(
+        (found[recipe_id] for recipe_id, _ in ranked if recipe_id in found),
+        view
+    )
+    return response_cache.put(request, Response(content=content, media_type="application/json"))
+
+@app.get("/recipes/by-ingredients", response_model=List[RecipeMatch])
+async def recipes_by_ingredients(
+    request: Request,
+    ingredients: List[str] = Query(..., description="Ingredientes disponibles; se admiten varios separados por comas"),
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    min_coverage: float = Query(0.0, ge=0.0, le=1.0),
+    max_missing: Optional[int] = Query(None, ge=0),
+    view: RecipeView = RecipeView.FULL,
+):
+    # "¿Qué puedo cocinar?": recetas ordenadas por la parte de sus
+    # ingredientes que hay en la despensa
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    pantry = [item for value in ingredients for item in value.split(",") if item.strip()]
+    matches = ingredient_index.match(pantry, limit, min_coverage, max_missing)
+    if not matches:
+        return response_cache.put(request, ORJSONResponse(content=[]))
+
+    found = {}
+    ids = [ObjectId(recipe_id) for recipe_id, *_ in matches]
+    async for recipe in db.recetas.find({"_id": {"$in": ids}}, VIEW_PROJECTIONS[view]):
+        found[str(recipe["_id"])] = recipe
+
+    # La receta ya va codificada: solo se añaden alrededor los datos de cobertura
+    content = b"[" + b",".join(
+        orjson.dumps({"coverage": coverage, "matched": matched, "missing": missing})[:-1]
+        + b',"recipe":' + recipe_encoder.encode(found[recipe_id], view) + b"}"
+        for recipe_id, coverage, matched, missing in matches
+        if recipe_id in found
+    ) + b"]"
+    return response_cache.put(request, Response(content=content, media_type="application/json"))
+
+async def _recipe_batch(
+    ids: List[str],
+    view: RecipeView,
+    with_shopping_list: bool,
+    servings: Dict[str, int],
+    default_servings: Optional[int] = None,
+) -> bytes:
+    if len(ids) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Como máximo se pueden pedir {MAX_BATCH_SIZE} recetas a la vez"
+        )
+    object_ids = {}
+    for recipe_id in ids:
+        try:
+            object_ids[recipe_id] = ObjectId(recipe_id)
+        except (InvalidId, TypeError):
+            pass
+
+    # Una sola consulta para todas; la lista de la compra necesita los ingredientes
+    projection = None if with_shopping_list else VIEW_PROJECTIONS[view]
+    found = {}
+    async for recipe in db.recetas.find({"_id": {"$in": list(object_ids.values())}}, projection):
+        found[str(recipe["_id"])] = recipe
+
+    results = []
+    for recipe_id in ids:
+        recipe = found.get(recipe_id)
+        if recipe is None:
+            error = "not_found" if recipe_id in object_ids else "invalid_id"
+            results.append(orjson.dumps({"id": recipe_id, "recipe": None, "error": error}))
+        else:
+            results.append(
+                b'{"id":' + orjson.dumps(recipe_id) + b',"recipe":'
+                + recipe_encoder.encode(recipe, view) + b',"error":null}'
+            )
+
+    shopping = None
+    if with_shopping_list:
+        entries = []
+        for recipe_id in ids:
+            recipe = found.get(recipe_id)
+            if recipe is None:
+                continue
+            wanted = servings.get(recipe_id, default_servings)
+            factor = wanted / recipe["servings"] if wanted and recipe.get("servings") else 1.0
+            entries.append((recipe, factor))
+        shopping = build_shopping_list(entries)
+
+    return b'{"results":[' + b",".join(results) + b'],"shopping_list":' + orjson.dumps(shopping) + b"}"
+
+@app.get("/recipes/batch", response_model=RecipeBatch)
+async def get_recipe_batch(
+    request: Request,
+    ids: List[str] = Query(..., description="Ids de receta; se admiten varios separados por comas"),
+    view: RecipeView = RecipeView.FULL,
+    shopping_list: bool = False,
+    servings: Optional[int] = Query(None, ge=1, description="Raciones para escalar la lista de la compra"),
+):
+    # Varias recetas en una sola petición, en el orden pedido; las que no
+    # existen llevan error en lugar de receta
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    recipe_ids = [recipe_id.strip() for value in ids for recipe_id in value.split(",") if recipe_id.strip()]
+    content = await _recipe_batch(recipe_ids, view, shopping_list, {}, servings)
+    return response_cache.put(request, Response(content=content, media_type="application/json"))
+
+@app.post("/recipes/batch", response_model=RecipeBatch)
+async def post_recipe_batch(batch: RecipeBatchRequest):
+    # Igual que GET /recipes/batch, para listas largas y raciones por receta
+    content = await _recipe_batch(batch.ids, batch.view, batch.shopping_list, batch.servings or {})
+    return Response(content=content, media_type="application/json")
 
 @app.get("/recipes/{recipe_id}", response_model=Recipe)
-async def get_recipe(recipe_id: str):
+async def get_recipe(recipe_id: str, request: Request):
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
     recipe = await db.recetas.find_one({"_id": ObjectId(recipe_id)})
     if recipe is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
-    recipe["id"] = str(recipe.pop("_id"))
-    # Añadir metadata por defecto si no existe
-    if "metadata" not in recipe:
-        recipe["metadata"] = {
-            "author": "unknown",
-            "created_at": datetime.utcnow(),
-            "updated_at": datetime.utcnow(),
-            "rating": None,
-            "reviews_count": 0
-        }
-    return Recipe(**recipe)
+    # El ETag lleva la versión de la receta, para usarlo luego en If-Match
+    etag = recipe_etag(recipe)
+    content = recipe_encoder.encode(recipe)
+    return response_cache.put(request, Response(content=content, media_type="application/json"), etag=etag)
+
+@app.get("/recipes/{recipe_id}/related", response_model=List[Recipe])
+async def get_related_recipes(
+    recipe_id: str,
+    request: Request,
+    limit: int = Query(6, ge=1, le=RELATED_NEIGHBOURS),
+    view: RecipeView = RecipeView.CARD,
+):
+    # Recetas parecidas por ingredientes, etiquetas y categoría, de la tabla
+    # precalculada
+    cached = response_cache.get(request)
+    if cached is not None:
+        return cached
+
+    related = related_index.related(recipe_id, limit)
+    if related is None:
+        if not related_index.ready:
+            try:
+                exists = await db.recetas.count_documents({"_id": ObjectId(recipe_id)}, limit=1)
+            except (InvalidId, TypeError):
+                exists = 0
+            if exists:
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Las recetas relacionadas se están calculando, inténtalo de nuevo en unos segundos",
+                    headers={"Retry-After": "5"}
+                )
+        raise HTTPException(status_code=404, detail="Receta no encontrada")
+
+    found = {}
+    ids = [ObjectId(related_id) for related_id, _ in related]
+    async for recipe in db.recetas.find({"_id": {"$in": ids}}, VIEW_PROJECTIONS[view]):
+        found[str(recipe["_id"])] = recipe
+
+    content = recipe_encoder.encode_list(
+        (found[related_id] for related_id, _ in related if related_id in found),
+        view
+    )
+    return response_cache.put(request, Response(content=content, media_type="application/json"))
+
+async def _update_recipe_fields(recipe_id: str, fields: dict, if_match: Optional[str]) -> tuple:
+    # Actualiza la receta en una sola operación atómica y devuelve la receta
+    # antes y después del cambio. Con If-Match solo se actualiza si la versión
+    # coincide; si no, 412.
+    version = expected_version(if_match, recipe_id)
+    now = metadata_now()
+    query = {"_id": ObjectId(recipe_id), "metadata": {"$exists": True}}
+    if version is not None:
+        query.update(version_filter(version))
+    before = await db.recetas.find_one_and_update(
+        query,
+        {"$set": {**fields, "metadata.updated_at": now}, "$inc": {"metadata.version": 1}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is not None:
+        metadata = {**before["metadata"], "updated_at": now, "version": recipe_version(before) + 1}
+        return before, {**before, **fields, "metadata": metadata}
+
+    # No existe, la versión no coincide o es una receta antigua que el
+    # backfill no ha completado
+    current = await db.recetas.find_one({"_id": ObjectId(recipe_id)}, {"metadata": 1, "tags": 1})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    precondition_failed = HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="La receta ha sido modificada por otra persona"
+    )
+    if isinstance(current.get("metadata"), dict):
+        raise precondition_failed
+    if version is not None and version != recipe_version(current):
+        raise precondition_failed
+
+    # La receta se completa aquí igual que lo haría el backfill (también si
+    # este ya ha terminado y se la saltó porque cambió mientras tanto)
+    fix = recipe_fix(current) or {}
+    metadata = {**fix["metadata"], "updated_at": now, "version": fix["metadata"]["version"] + 1}
+    changes = {**fix, **fields, "metadata": metadata}
+    before = await db.recetas.find_one_and_update(
+        {"_id": current["_id"], "metadata": current.get("metadata")},
+        {"$set": changes},
+        return_document=ReturnDocument.BEFORE
+    )
+    if before is None:
+        raise precondition_failed
+    return before, {**before, **changes}
 
 @app.put("/recipes/{recipe_id}", response_model=Recipe)
-async def update_recipe(recipe_id: str, recipe: RecipeCreate, current_user: User = Depends(get_current_user)):
+async def update_recipe(
+    recipe_id: str,
+    recipe: RecipeCreate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
     # Convertir el modelo a diccionario
     recipe_dict = recipe.dict()
     
@@ -166,74 +631,257 @@ async def update_recipe(recipe_id: str, recipe: RecipeCreate, current_user: User
     if "tags" in recipe_dict and isinstance(recipe_dict["tags"], set):
         recipe_dict["tags"] = list(recipe_dict["tags"])
     
-    # Obtener la receta existente para mantener los metadatos
-    existing_recipe = await db.recetas.find_one({"_id": ObjectId(recipe_id)})
-    if existing_recipe is None:
-        raise HTTPException(status_code=404, detail="Recipe not found")
-    
-    # Mantener los metadatos existentes, solo actualizar updated_at
-    metadata = existing_recipe.get("metadata", {
-        "author": "unknown",
-        "created_at": datetime.utcnow(),
-        "rating": None,
-        "reviews_count": 0
-    })
-    metadata["updated_at"] = datetime.utcnow()
-    recipe_dict["metadata"] = metadata
-    
-    # Actualizar la receta
-    result = await db.recetas.update_one(
-        {"_id": ObjectId(recipe_id)},
-        {"$set": recipe_dict}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Recipe not found or not modified")
+    existing_recipe, updated_recipe = await _update_recipe_fields(recipe_id, recipe_dict, if_match)
+    await _on_recipe_write(existing_recipe, updated_recipe)
+    response.headers["ETag"] = recipe_etag(updated_recipe)
+    return Recipe(**prepare_recipe(dict(updated_recipe)))
+
+@app.patch("/recipes/{recipe_id}", response_model=Recipe)
+async def patch_recipe(
+    recipe_id: str,
+    recipe: RecipeUpdate,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    # Solo se modifican los campos enviados ($set parcial)
+    changes = {
+        field: value
+        for field, value in recipe.model_dump(exclude_unset=True).items()
+        if value is not None or field == "image_path"
+    }
+    if "tags" in changes:
+        changes["tags"] = list(changes["tags"])
     
-    # Obtener la receta actualizada
-    updated_recipe = await db.recetas.find_one({"_id": ObjectId(recipe_id)})
-    updated_recipe["id"] = str(updated_recipe.pop("_id"))
-    return Recipe(**updated_recipe)
+    existing_recipe, updated_recipe = await _update_recipe_fields(recipe_id, changes, if_match)
+    await _on_recipe_write(existing_recipe, updated_recipe)
+    response.headers["ETag"] = recipe_etag(updated_recipe)
+    return Recipe(**prepare_recipe(dict(updated_recipe)))
 
 @app.delete("/recipes/{recipe_id}", response_model=dict)
 async def delete_recipe(recipe_id: str, current_user: User = Depends(get_current_user)):
-    result = await db.recetas.delete_one({"_id": ObjectId(recipe_id)})
-    if result.deleted_count == 0:
+    deleted = await db.recetas.find_one_and_delete(
+        {"_id": ObjectId(recipe_id)},
+        projection={"tags": 1}
+    )
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
+    await _on_recipe_write(deleted, None)
     return {"message": "Recipe deleted successfully"}
 
 # Endpoint para obtener todas las etiquetas existentes
-@app.get("/tags/", response_model=List[str])
-async def get_tags():
-    # Obtener todas las etiquetas únicas de todas las recetas
-    tags = set()
-    async for recipe in db.recetas.find():
-        if "tags" in recipe:
-            tags.update(recipe["tags"])
-    return sorted(list(tags))
+@app.get("/tags/", response_model=Union[List[str], List[TagCount]])
+async def get_tags(with_counts: bool = False):
+    # Las etiquetas salen del índice en memoria, no de recorrer las recetas
+    counts = await tag_index.get_counts(db)
+    if with_counts:
+        return [TagCount(tag=tag, count=count) for tag, count in counts]
+    return [tag for tag, _ in counts]
+
+async def _retag_job(db: AsyncIOMotorDatabase, job: JobContext) -> dict:
+    # Quita unas etiquetas de todas las recetas que las usan (y pone otra en
+    # su lugar, si se indica), por lotes. Cada lote deja de encajar en la
+    # consulta, así que repetir el trabajo tras un fallo continúa donde iba.
+    remove, add = job.params["remove"], job.params.get("add")
+    query = {"tags": {"$in": remove}}
+    processed = job.processed
+    await job.progress(processed, processed + await db.recetas.count_documents(query))
+    while True:
+        batch = await db.recetas.find(query, {"_id": 1}).limit(JOB_BATCH_SIZE).to_list(length=None)
+        if not batch:
+            break
+        ids = [recipe["_id"] for recipe in batch]
+        if add:
+            await db.recetas.update_many({"_id": {"$in": ids}}, {"$addToSet": {"tags": add}})
+        # Las recetas cambian: nueva versión y updated_at (el JSON cacheado por
+        # receta depende de ellos). Las recetas antiguas sin metadata solo
+        # pierden la etiqueta.
+        await db.recetas.update_many(
+            {"_id": {"$in": ids}, "metadata": {"$exists": True}},
+            {
+                "$pull": {"tags": {"$in": remove}},
+                "$set": {"metadata.updated_at": datetime.utcnow()},
+                "$inc": {"metadata.version": 1}
+            }
+        )
+        await db.recetas.update_many({"_id": {"$in": ids}}, {"$pull": {"tags": {"$in": remove}}})
+        recipes = await catalog.refresh(db, ids)
+        search_index.update_many(recipes)
+        related_index.update_many(recipes)
+        response_cache.invalidate()
+        processed += len(ids)
+        await job.progress(processed)
+    await tag_index.rebuild(db)
+    return {"recipes": processed}
+
+async def _image_variants_job(db: AsyncIOMotorDatabase, job: JobContext) -> dict:
+    # Vuelve a generar las variantes de todas las fotos locales (por ejemplo,
+    # tras cambiar tamaños o calidad), en el orden del nombre de fichero
+    images = sorted(path for path in IMAGES_DIR.iterdir() if path.is_file())
+    processed = job.processed
+    await job.progress(processed, len(images))
+    for image in images[processed:]:
+        await image_variants.generate_all(image, force=True)
+        processed += 1
+        await job.progress(processed)
+    return {"images": processed}
+
+async def _reindex_job(db: AsyncIOMotorDatabase, job: JobContext) -> dict:
+    # Índices de Mongo y recuento de etiquetas (compartidos por todos los
+    # workers) e índices en memoria del worker que ejecuta el trabajo
+    steps = [
+        ("mongo_indexes", ensure_indexes),
+        ("tags", tag_index.rebuild),
+        ("search", search_index.build),
+        ("ingredients", ingredient_index.build),
+        ("catalog", catalog.build),
+    ]
+    for done, (_, step) in enumerate(steps[job.processed:], start=job.processed):
+        await job.progress(done, len(steps))
+        await step(db)
+    related_index.request_rebuild()
+    response_cache.invalidate()
+    await job.progress(len(steps))
+    return {"steps": [name for name, _ in steps]}
+
+job_runner.register("tag_retag", _retag_job)
+job_runner.register("image_variants", _image_variants_job)
+job_runner.register("reindex", _reindex_job)
+
+def _job_accepted(job: dict, message: str) -> ORJSONResponse:
+    # 202 con el trabajo encolado; el avance se consulta en /jobs/{id}
+    return ORJSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={"message": message, "job_id": job["_id"], "status": job["status"]},
+        headers={"Location": f"/jobs/{job['_id']}"}
+    )
+
+def _job_payload(job: dict) -> dict:
+    job["id"] = job.pop("_id")
+    return jsonable_encoder(job)
 
 # Endpoint para eliminar una etiqueta
 @app.delete("/tags/{tag}")
-async def delete_tag(tag: str):
-    # Eliminar la etiqueta de todas las recetas que la usan
-    await db.recetas.update_many(
-        {"tags": tag},
-        {"$pull": {"tags": tag}}
+async def delete_tag(tag: str, current_user: User = Depends(get_current_active_user),
+                     _: None = Depends(admin_required)):
+    # Se quita de las recetas en segundo plano, por lotes
+    job = await job_runner.submit(db, "tag_retag", {"remove": [tag]}, created_by=current_user.username)
+    return _job_accepted(job, f"Eliminando la etiqueta '{tag}'")
+
+@app.post("/tags/merge")
+async def merge_tags(merge: TagMerge, current_user: User = Depends(get_current_active_user),
+                     _: None = Depends(admin_required)):
+    target = merge.target.strip()
+    sources = [tag for tag in dict.fromkeys(merge.sources) if tag != target]
+    if not target or not sources:
+        raise HTTPException(status_code=400, detail="Indica la etiqueta de destino y al menos otra que fusionar")
+    job = await job_runner.submit(
+        db, "tag_retag", {"remove": sources, "add": target}, created_by=current_user.username
+    )
+    return _job_accepted(job, f"Fusionando {len(sources)} etiquetas en '{target}'")
+
+@app.post("/tags/{tag}/rename")
+async def rename_tag(tag: str, rename: TagRename, current_user: User = Depends(get_current_active_user),
+                     _: None = Depends(admin_required)):
+    new_name = rename.new_name.strip()
+    if not new_name or new_name == tag:
+        raise HTTPException(status_code=400, detail="El nuevo nombre debe ser distinto y no estar vacío")
+    job = await job_runner.submit(
+        db, "tag_retag", {"remove": [tag], "add": new_name}, created_by=current_user.username
+    )
+    return _job_accepted(job, f"Renombrando la etiqueta '{tag}' a '{new_name}'")
+
+@app.post("/jobs/image-variants")
+async def rebuild_image_variants(current_user: User = Depends(get_current_active_user),
+                                 _: None = Depends(admin_required)):
+    job = await job_runner.submit(db, "image_variants", created_by=current_user.username)
+    return _job_accepted(job, "Regenerando las variantes de las imágenes")
+
+@app.post("/jobs/reindex")
+async def rebuild_indexes(current_user: User = Depends(get_current_active_user),
+                          _: None = Depends(admin_required)):
+    job = await job_runner.submit(db, "reindex", created_by=current_user.username)
+    return _job_accepted(job, "Reconstruyendo los índices")
+
+@app.get("/jobs/")
+async def get_jobs(limit: int = Query(50, ge=1, le=500), _: None = Depends(admin_required)):
+    return [_job_payload(job) for job in await job_runner.recent(db, limit)]
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, _: None = Depends(admin_required)):
+    # Estado y avance (processed/total) de un trabajo en segundo plano
+    job = await job_runner.get(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return _job_payload(job)
+
+@app.get("/cache/stats")
+async def get_cache_stats(_: None = Depends(admin_required)):
+    # Contadores de la caché de respuestas, para dimensionarla
+    return {**response_cache.stats(), "recipe_json": recipe_encoder.stats(), "catalog": catalog.stats()}
+
+@app.get("/db/stats")
+async def get_db_stats(_: None = Depends(admin_required)):
+    # Uso del pool de conexiones de este worker, para ajustar MONGO_MAX_POOL_SIZE
+    return get_pool_stats()
+
+@app.get("/db/backfill")
+async def get_backfill_progress(_: None = Depends(admin_required)):
+    # Avance de la migración de recetas antiguas (metadata y etiquetas)
+    return jsonable_encoder(await recipe_backfill.progress(db))
+
+@app.get("/db/indexes")
+async def get_index_usage(_: None = Depends(admin_required)):
+    # Uso de cada índice ($indexStats), para detectar índices que sobran o faltan
+    return jsonable_encoder(await index_usage_report(db))
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    # Formato de exposición de Prometheus
+    return PlainTextResponse(
+        render_metrics({
+            "mongo_pool": get_pool_stats(),
+            "response_cache": response_cache.stats(),
+            "recipe_json_cache": recipe_encoder.stats(),
+            "catalog": catalog.stats(),
+            "password_hashing": hashing_executor.stats(),
+            "jobs": job_runner.stats(),
+            "auth": refresh_token_store.stats(),
+            "admission": admission_controller.stats(),
+        }),
+        media_type="text/plain; version=0.0.4"
     )
-    return {"message": f"Etiqueta '{tag}' eliminada correctamente"}
 
 @app.post("/upload-image/")
-async def upload_image(file: UploadFile = File(...)):
-    try:
-        # Subir imagen a Cloudinary
-        result = cloudinary.uploader.upload(file.file)
-        print("Resultado de Cloudinary:", result)  # Debug
-        
-        # Devolver la URL de la imagen
-        return {"url": result["secure_url"]}
-    except Exception as e:
-        print("Error al subir imagen:", str(e))  # Debug
-        raise HTTPException(status_code=500, detail=str(e))
+async def upload_image(file: UploadFile = File(...), wait: bool = True):
+    # Con wait=false se responde enseguida con el id de la imagen y la subida
+    # continúa en segundo plano; el estado se consulta en /upload-image/{id}
+    result = await upload_pipeline.submit(db, file, wait=wait)
+    if result["status"] == "failed":
+        raise HTTPException(status_code=500, detail=result["error"])
+    if result["status"] == "pending":
+        return ORJSONResponse(status_code=status.HTTP_202_ACCEPTED, content=result)
+    return result
+
+@app.get("/upload-image/{image_id}")
+async def get_upload_status(image_id: str):
+    result = await upload_pipeline.status(db, image_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return result
+
+@app.get(VARIANT_ENDPOINT + "/{image_name}/{variant_file}")
+async def get_image_variant(image_name: str, variant_file: str):
+    # Genera la variante la primera vez y redirige a su URL con hash, que se
+    # sirve con Cache-Control inmutable
+    variant, _, fmt = variant_file.partition(".")
+    if variant not in VARIANT_WIDTHS or fmt not in VARIANT_FORMATS:
+        raise HTTPException(status_code=404, detail="Unknown image variant")
+    source = image_variants.source_path(image_name)
+    if source is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    url = await image_variants.ensure(source, variant, fmt)
+    return RedirectResponse(url, headers={"Cache-Control": "public, max-age=300"})
 
 @app.get("/users/")
 async def get_users(
@@ -263,7 +911,7 @@ async def create_new_user(
         )
     
     # Crear el nuevo usuario
-    hashed_password = get_password_hash(user_create.password)
+    hashed_password = await get_password_hash_async(user_create.password)
     new_user = {
         "username": user_create.username,
         "hashed_password": hashed_password,
@@ -294,6 +942,8 @@ async def delete_user(
         )
     
     result = await db["users"].delete_one({"username": username})
+    invalidate_principal(username)
+    await revoke_user_sessions(username)
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -303,6 +953,46 @@ async def delete_user(
     
     return {"message": "Usuario eliminado correctamente"}
 
+@app.patch("/users/{username}")
+async def update_user(
+    username: str,
+    user_update: UserUpdate,
+    _: None = Depends(admin_required),
+    db: AsyncIOMotorDatabase = Depends(get_database)
+):
+    changes = user_update.model_dump(exclude_none=True)
+    if username == "admin" and changes:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No se puede modificar al usuario admin"
+        )
+
+    before = await db["users"].find_one_and_update(
+        {"username": username},
+        {"$set": changes},
+        return_document=ReturnDocument.BEFORE
+    ) if changes else await db["users"].find_one({"username": username})
+
+    if before is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Usuario no encontrado"
+        )
+    user = {**before, **changes}
+
+    # Los cambios tienen efecto inmediato: get_current_user rechaza las
+    # cuentas desactivadas y, al desactivar o quitar el rol de administrador,
+    # se cierran las sesiones (sus tokens llevan is_admin dentro)
+    invalidate_principal(username)
+    if changes.get("disabled") or (before.get("is_admin", False) and changes.get("is_admin") is False):
+        await revoke_user_sessions(username)
+
+    return {
+        "username": user["username"],
+        "is_admin": user.get("is_admin", False),
+        "disabled": user.get("disabled", False)
+    }
+
 # Script para crear el primer usuario admin
 @app.post("/initial-setup")
 async def initial_setup():
@@ -317,7 +1007,7 @@ async def initial_setup():
         )
     
     # Crear usuario admin
-    hashed_password = get_password_hash("adminpassword")
+    hashed_password = await get_password_hash_async("adminpassword")
     new_admin = {
         "username": "admin",
         "hashed_password": hashed_password,
@@ -332,8 +1022,7 @@ async def initial_setup():
 async def create_recipe(recipe: Recipe):
     db = get_database()
     recipe_dict = recipe.model_dump()
-    print("Datos de la receta a guardar:", recipe_dict)  # Debug
-    
+
     result = await db["recipes"].insert_one(recipe_dict)
     created_recipe = await db["recipes"].find_one({"_id": result.inserted_id})
     
@@ -0,0 +1,217 @@
+import bisect
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import orjson
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Peticiones más lentas que esto (o con más consultas a Mongo que el umbral)
+# se registran en el log, solo una fracción de ellas
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+SLOW_REQUEST_MONGO_COMMANDS = int(os.getenv("SLOW_REQUEST_MONGO_COMMANDS", 20))
+SLOW_REQUEST_LOG_SAMPLE_RATE = float(os.getenv("SLOW_REQUEST_LOG_SAMPLE_RATE", 0.1))
+
+METRICS_PREFIX = "recetarium"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COMMANDS_PER_REQUEST_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Histograma acumulado por combinación de etiquetas, al estilo Prometheus."""
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], buckets: Iterable[float]):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # etiquetas -> [cuenta por bucket..., +Inf, suma]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labels, values in sorted(series.items()):
+            base = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, labels))
+            prefix = base + "," if base else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            cumulative += values[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{base}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestStats:
+    """Consultas a Mongo hechas durante una petición."""
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_seconds = 0.0
+        self.by_command: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add(self, command: str, seconds: float):
+        # Motor lanza las operaciones en hilos, a veces varias a la vez
+        with self._lock:
+            self.mongo_commands += 1
+            self.mongo_seconds += seconds
+            self.by_command[command] = self.by_command.get(command, 0) + 1
+
+
+# Motor copia el contexto al hilo que ejecuta cada operación, así que el
+# listener de comandos ve las estadísticas de la petición que la lanzó
+_current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+http_request_duration = Histogram(
+    f"{METRICS_PREFIX}_http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por ruta.",
+    ("method", "route", "status"),
+    LATENCY_BUCKETS,
+)
+http_request_mongo_commands = Histogram(
+    f"{METRICS_PREFIX}_http_request_mongo_commands",
+    "Comandos de MongoDB por petición HTTP.",
+    ("method", "route"),
+    COMMANDS_PER_REQUEST_BUCKETS,
+)
+mongo_command_duration = Histogram(
+    f"{METRICS_PREFIX}_mongo_command_duration_seconds",
+    "Duración de los comandos de MongoDB.",
+    ("command", "outcome"),
+    MONGO_LATENCY_BUCKETS,
+)
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Duración de cada comando de Mongo, también atribuida a la petición en curso."""
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_duration.observe((event.command_name, outcome), seconds)
+        stats = _current_request.get()
+        if stats is not None:
+            stats.add(event.command_name, seconds)
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event, "ok")
+
+    def failed(self, event):
+        self._record(event, "error")
+
+
+command_metrics = CommandMetrics()
+
+requests_in_flight = 0
+
+
+def _route_name(scope: dict) -> str:
+    route = scope.get("route")
+    # Las peticiones que no encajan con ninguna ruta se agrupan para no crear
+    # una serie por cada URL desconocida
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide cada petición HTTP y sus consultas a Mongo."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global requests_in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current_request.set(stats)
+        status_code = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        requests_in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            requests_in_flight -= 1
+            _current_request.reset(token)
+            elapsed = time.perf_counter() - started
+            method = scope["method"]
+            route = _route_name(scope)
+            http_request_duration.observe((method, route, str(status_code)), elapsed)
+            http_request_mongo_commands.observe((method, route), stats.mongo_commands)
+            if (elapsed * 1000 >= SLOW_REQUEST_MS or stats.mongo_commands >= SLOW_REQUEST_MONGO_COMMANDS) \
+                    and random.random() < SLOW_REQUEST_LOG_SAMPLE_RATE:
+                logger.warning(orjson.dumps({
+                    "event": "slow_request",
+                    "method": method,
+                    "route": route,
+                    "path": scope["path"],
+                    "status": status_code,
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "mongo_commands": stats.mongo_commands,
+                    "mongo_ms": round(stats.mongo_seconds * 1000, 3),
+                    "mongo_by_command": stats.by_command,
+                }).decode())
+
+
+def _gauges(group: str, values: dict) -> List[str]:
+    lines = []
+    for key, value in values.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{METRICS_PREFIX}_{group}_{key}"
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return lines
+
+
+def render_metrics(gauges: Dict[str, dict]) -> str:
+    """Texto en el formato de exposición de Prometheus.
+
+    gauges agrupa estadísticas sueltas (pool de Mongo, cachés...) que se
+    publican como gauges con el prefijo del grupo.
+    """
+    lines = []
+    for histogram in (http_request_duration, http_request_mongo_commands, mongo_command_duration):
+        lines.extend(histogram.render())
+    lines.extend(_gauges("http", {"requests_in_flight": requests_in_flight}))
+    for group, values in gauges.items():
+        lines.extend(_gauges(group, values))
+    return "\n".join(lines) + "\n"
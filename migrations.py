@@ -0,0 +1,126 @@
+import logging
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+from filters import RECIPE_INDEXES
+from jobs import JOB_INDEXES, JOBS_COLLECTION
+from refresh_tokens import (
+    REFRESH_TOKEN_INDEXES,
+    REFRESH_TOKENS_COLLECTION,
+    REVOKED_SESSION_INDEXES,
+    REVOKED_SESSIONS_COLLECTION,
+)
+
+logger = logging.getLogger(__name__)
+
+# Registro de índices por colección. Lo que no esté aquí (salvo _id) se
+# señala en el informe de uso como índice no declarado.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        IndexModel([("username", ASCENDING)], unique=True, name="username_unique"),
+    ],
+    "recetas": [IndexModel(keys) for keys in RECIPE_INDEXES],
+    JOBS_COLLECTION: JOB_INDEXES,
+    REFRESH_TOKENS_COLLECTION: REFRESH_TOKEN_INDEXES,
+    REVOKED_SESSIONS_COLLECTION: REVOKED_SESSION_INDEXES,
+}
+
+MIGRATIONS_COLLECTION = "migrations"
+
+
+async def _add_recipe_versions(db: AsyncIOMotorDatabase):
+    # Recetas creadas antes del contador de versiones
+    await db.recetas.update_many(
+        {"metadata": {"$exists": True}, "metadata.version": {"$exists": False}},
+        {"$set": {"metadata.version": 1}}
+    )
+
+
+async def _drop_single_tags_index(db: AsyncIOMotorDatabase):
+    # El índice compuesto que empieza por tags lo hace innecesario
+    try:
+        await db.recetas.drop_index("tags_1")
+    except OperationFailure:
+        pass
+
+
+# Migraciones en orden; cada una se aplica una sola vez por base de datos
+MIGRATIONS: List[Tuple[int, str, Callable[[AsyncIOMotorDatabase], Awaitable[None]]]] = [
+    (1, "add_recipe_versions", _add_recipe_versions),
+    (2, "drop_single_tags_index", _drop_single_tags_index),
+]
+
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    for collection, indexes in INDEXES.items():
+        try:
+            names = await db[collection].create_indexes(indexes)
+            logger.info(f"Indexes ready on {collection}: {', '.join(names)}")
+        except OperationFailure as e:
+            # Por ejemplo, usuarios duplicados que impiden el índice único
+            logger.error(f"Could not create indexes on {collection}: {e}")
+
+
+async def apply_migrations(db: AsyncIOMotorDatabase):
+    for version, name, migration in MIGRATIONS:
+        try:
+            # La inserción hace de cerrojo entre workers que arrancan a la vez
+            await db[MIGRATIONS_COLLECTION].insert_one(
+                {"_id": version, "name": name, "status": "running", "started_at": datetime.utcnow()}
+            )
+        except DuplicateKeyError:
+            continue
+        try:
+            await migration(db)
+        except Exception as e:
+            logger.error(f"Migration {version} ({name}) failed: {e}")
+            await db[MIGRATIONS_COLLECTION].delete_one({"_id": version})
+            raise
+        await db[MIGRATIONS_COLLECTION].update_one(
+            {"_id": version},
+            {"$set": {"status": "done", "applied_at": datetime.utcnow()}}
+        )
+        logger.info(f"Applied migration {version} ({name})")
+
+
+async def index_usage_report(db: AsyncIOMotorDatabase) -> List[dict]:
+    """Uso de cada índice según $indexStats (desde el último reinicio de mongod)."""
+    report = []
+    for collection, indexes in INDEXES.items():
+        declared = {index.document["name"] for index in indexes}
+        async for stats in db[collection].aggregate([{"$indexStats": {}}]):
+            name = stats["name"]
+            report.append({
+                "collection": collection,
+                "index": name,
+                "ops": stats["accesses"]["ops"],
+                "since": stats["accesses"]["since"],
+                "declared": name == "_id_" or name in declared,
+            })
+    return report
+
+
+async def log_index_usage(db: AsyncIOMotorDatabase):
+    try:
+        report = await index_usage_report(db)
+    except Exception as e:
+        # El informe es solo informativo: nunca debe impedir el arranque
+        logger.warning(f"Could not read $indexStats: {e}")
+        return
+    for entry in report:
+        if not entry["declared"]:
+            logger.warning(f"Index {entry['collection']}.{entry['index']} is not in the index registry")
+        elif entry["ops"] == 0 and entry["index"] != "_id_":
+            logger.warning(f"Index {entry['collection']}.{entry['index']} has not been used since {entry['since']}")
+        else:
+            logger.info(f"Index {entry['collection']}.{entry['index']}: {entry['ops']} ops")
+
+
+async def run_migrations(db: AsyncIOMotorDatabase):
+    await ensure_indexes(db)
+    await apply_migrations(db)
+    await log_index_usage(db)
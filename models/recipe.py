@@ -5,8 +5,8 @@ from enum import Enum
 
 class Ingredient(BaseModel):
     item: str
-    amount: float
-    unit: str
+    amount: Optional[float] = None
+    unit: Optional[str] = None
 
 class Instruction(BaseModel):
     step: int
@@ -23,6 +23,7 @@ class Metadata(BaseModel):
     updated_at: datetime
     rating: Optional[float] = None
     reviews_count: Optional[int] = 0
+    version: Optional[int] = 0
 
 class RecipeCategory(str, Enum):
     APERITIVOS = "Aperitivos"
@@ -73,10 +74,100 @@ class RecipeBase(BaseModel):
 class RecipeCreate(RecipeBase):
     pass
 
+# Actualización parcial (PATCH): todos los campos son opcionales
+class RecipeUpdate(BaseModel):
+    title: Optional[str] = None
+    comment: Optional[str] = None
+    description: Optional[str] = None
+    ingredients: Optional[List[str]] = None
+    instructions: Optional[List[str]] = None
+    cooking_time: Optional[int] = None
+    servings: Optional[int] = None
+    category: Optional[RecipeCategory] = None
+    tags: Optional[Set[str]] = None
+    image_path: Optional[str] = None
+
 class Recipe(RecipeBase):
     id: str
     metadata: Metadata
+    image_variants: Optional[Dict[str, str]] = None
 
     class Config:
         from_attributes = True
-        populate_by_name = True
\ No newline at end of file
+        populate_by_name = True
+
+class RecipeView(str, Enum):
+    FULL = "full"
+    CARD = "card"
+
+# Vista reducida para listados: sin ingredientes ni instrucciones
+class RecipeCard(BaseModel):
+    id: str
+    title: str
+    comment: str
+    description: str
+    cooking_time: int
+    servings: int
+    category: RecipeCategory
+    tags: Set[str]
+    image_path: Optional[str] = None
+    image_variants: Optional[Dict[str, str]] = None
+    metadata: Optional[Metadata] = None
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+class TagRename(BaseModel):
+    new_name: str
+
+class TagMerge(BaseModel):
+    # Etiquetas que desaparecen; sus recetas pasan a tener target
+    sources: List[str]
+    target: str
+
+class FacetCount(BaseModel):
+    value: str
+    count: int
+
+class CookingTimeBucket(BaseModel):
+    min: int
+    max: Optional[int] = None
+    count: int
+
+class RecipeFacets(BaseModel):
+    total: int
+    categories: List[FacetCount]
+    tags: List[FacetCount]
+    cooking_time: List[CookingTimeBucket]
+    # Recetas sin tiempo de cocción válido (falta, es nulo o negativo)
+    cooking_time_unknown: int = 0
+
+class RecipeMatch(BaseModel):
+    coverage: float
+    matched: int
+    missing: List[str]
+    recipe: Recipe
+
+class ShoppingItem(BaseModel):
+    item: str
+    amount: Optional[float] = None
+    unit: Optional[str] = None
+    recipes: List[str]
+
+class BatchResult(BaseModel):
+    id: str
+    recipe: Optional[Recipe] = None
+    # "not_found" o "invalid_id" cuando no hay receta
+    error: Optional[str] = None
+
+class RecipeBatch(BaseModel):
+    results: List[BatchResult]
+    shopping_list: Optional[List[ShoppingItem]] = None
+
+class RecipeBatchRequest(BaseModel):
+    ids: List[str]
+    # Raciones deseadas por receta para escalar la lista de la compra
+    servings: Optional[Dict[str, int]] = None
+    shopping_list: bool = False
+    view: RecipeView = RecipeView.FULL
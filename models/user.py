@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class User(BaseModel):
     username: str
@@ -11,4 +12,8 @@ class UserInDB(User):
 class UserCreate(BaseModel):
     username: str
     password: str
-    is_admin: bool = False
\ No newline at end of file
+    is_admin: bool = False
+
+class UserUpdate(BaseModel):
+    is_admin: Optional[bool] = None
+    disabled: Optional[bool] = None
@@ -0,0 +1,96 @@
+import base64
+from enum import Enum
+from typing import Any, Optional, Tuple
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException
+from pymongo import ASCENDING, DESCENDING
+
+# Tamaño de página máximo que aceptamos en una sola petición
+MAX_PAGE_SIZE = 200
+
+
+class SortKey(str, Enum):
+    ID = "id"
+    CREATED_AT = "created_at"
+    TITLE = "title"
+    COOKING_TIME = "cooking_time"
+    SERVINGS = "servings"
+
+
+class SortDirection(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+# Campo de Mongo asociado a cada clave de ordenación
+SORT_FIELDS = {
+    SortKey.ID: "_id",
+    SortKey.CREATED_AT: "metadata.created_at",
+    SortKey.TITLE: "title",
+    SortKey.COOKING_TIME: "cooking_time",
+    SortKey.SERVINGS: "servings",
+}
+
+
+def _get_path(doc: dict, path: str) -> Any:
+    value: Any = doc
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def sort_spec(field: str, direction: SortDirection) -> list:
+    # Siempre desempatamos por _id para que el orden sea total y estable
+    order = ASCENDING if direction == SortDirection.ASC else DESCENDING
+    if field == "_id":
+        return [("_id", order)]
+    return [(field, order), ("_id", order)]
+
+
+def encode_cursor(doc: dict, field: str) -> str:
+    # El cursor guarda el valor de la clave de ordenación y el _id del último
+    # documento devuelto; json_util conserva los tipos datetime y ObjectId
+    payload = {"v": _get_path(doc, field), "id": doc["_id"]}
+    raw = json_util.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, ObjectId]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json_util.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = payload["id"]
+        if not isinstance(last_id, ObjectId):
+            raise ValueError("invalid id")
+        return payload.get("v"), last_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
+
+def keyset_filter(field: str, direction: SortDirection, cursor: Optional[str]) -> dict:
+    """Filtro que devuelve los documentos posteriores al cursor.
+
+    Los documentos a los que les falta el campo (p. ej. recetas antiguas sin
+    metadata) lo tienen a null; Mongo los ordena antes que cualquier otro
+    valor, así que se tratan como el valor mínimo.
+    """
+    if not cursor:
+        return {}
+    value, last_id = decode_cursor(cursor)
+    op = "$gt" if direction == SortDirection.ASC else "$lt"
+    if field == "_id":
+        return {"_id": {op: last_id}}
+
+    tie = {field: value, "_id": {op: last_id}}
+    if value is None:
+        if direction == SortDirection.ASC:
+            return {"$or": [tie, {field: {"$ne": None}}]}
+        return tie
+    after = {field: {op: value}}
+    if direction == SortDirection.DESC:
+        # En orden descendente los null van al final
+        return {"$or": [after, tie, {field: None}]}
+    return {"$or": [after, tie]}
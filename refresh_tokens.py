@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, ReturnDocument, UpdateOne
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", 30))
+# Cada cuánto se leen las sesiones revocadas en otros workers
+REVOCATION_POLL_SECONDS = float(os.getenv("REVOCATION_POLL_SECONDS", 5))
+# Dos peticiones casi a la vez con el mismo refresh token (varias pestañas)
+# no se tratan como robo del token
+REFRESH_REUSE_GRACE_SECONDS = 10
+
+REFRESH_TOKENS_COLLECTION = "refresh_tokens"
+REVOKED_SESSIONS_COLLECTION = "revoked_sessions"
+
+# Mongo borra solo los tokens caducados y las revocaciones que ya no hacen
+# falta (las de sesiones cuyos access tokens han caducado)
+REFRESH_TOKEN_INDEXES = [
+    IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    IndexModel([("username", ASCENDING)]),
+]
+REVOKED_SESSION_INDEXES = [
+    IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+]
+
+
+def hash_token(token: str) -> str:
+    # El token es aleatorio y largo: basta un hash rápido, no hace falta bcrypt
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class RefreshTokenStore:
+    """Refresh tokens opacos y sesiones revocadas.
+
+    Cada inicio de sesión abre una sesión (sid) que llevan sus access tokens.
+    En Mongo solo se guarda el sha256 de cada refresh token; se usan una sola
+    vez y cada uso devuelve uno nuevo de la misma sesión. Las sesiones
+    revocadas se guardan en Mongo hasta que caducan sus access tokens, y
+    cada worker tiene una copia en memoria para comprobarlas sin consultas.
+    """
+
+    def __init__(self):
+        # sid -> hasta cuándo hay que rechazar sus access tokens
+        self._revoked: Dict[str, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.refreshed = 0
+        self.reuse_detected = 0
+
+    async def issue(self, db: AsyncIOMotorDatabase, username: str, sid: Optional[str] = None) -> Tuple[str, str]:
+        """Crea un refresh token; devuelve (token, sid)."""
+        token = secrets.token_urlsafe(32)
+        sid = sid or uuid.uuid4().hex
+        now = datetime.utcnow()
+        await db[REFRESH_TOKENS_COLLECTION].insert_one({
+            "_id": hash_token(token),
+            "sid": sid,
+            "username": username,
+            "created_at": now,
+            "expires_at": now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        })
+        return token, sid
+
+    async def consume(self, db: AsyncIOMotorDatabase, token: str, access_token_ttl: timedelta) -> Optional[dict]:
+        """Marca el token como usado y devuelve su registro, o None si no vale.
+
+        Un token ya usado que vuelve a llegar indica que alguien más lo tiene:
+        se revoca toda la sesión.
+        """
+        now = datetime.utcnow()
+        record = await db[REFRESH_TOKENS_COLLECTION].find_one_and_update(
+            {"_id": hash_token(token)},
+            {"$set": {"used_at": now}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if record is None or record["expires_at"] <= now or self.is_revoked(record["sid"]):
+            return None
+        if record.get("used_at") is not None:
+            if now - record["used_at"] > timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS):
+                self.reuse_detected += 1
+                logger.warning(f"Refresh token reused for {record['username']}, revoking session")
+                await self.revoke(db, [record["sid"]], access_token_ttl)
+            return None
+        self.refreshed += 1
+        return record
+
+    async def revoke(self, db: AsyncIOMotorDatabase, sids, access_token_ttl: timedelta):
+        """Revoca sesiones: sus refresh tokens se borran y sus access tokens dejan de valer."""
+        sids = list(sids)
+        if not sids:
+            return
+        until = datetime.utcnow() + access_token_ttl
+        for sid in sids:
+            self._revoked[sid] = until
+        await db[REVOKED_SESSIONS_COLLECTION].bulk_write([
+            UpdateOne({"_id": sid}, {"$set": {"expires_at": until}}, upsert=True) for sid in sids
+        ], ordered=False)
+        await db[REFRESH_TOKENS_COLLECTION].delete_many({"sid": {"$in": sids}})
+
+    async def revoke_user(self, db: AsyncIOMotorDatabase, username: str, access_token_ttl: timedelta):
+        """Cierra todas las sesiones de un usuario (al borrarlo o desactivarlo)."""
+        sids = await db[REFRESH_TOKENS_COLLECTION].distinct("sid", {"username": username})
+        await self.revoke(db, sids, access_token_ttl)
+
+    def is_revoked(self, sid: Optional[str]) -> bool:
+        if sid is None:
+            return False
+        until = self._revoked.get(sid)
+        return until is not None and until > datetime.utcnow()
+
+    async def reload(self, db: AsyncIOMotorDatabase):
+        revoked = {}
+        async for entry in db[REVOKED_SESSIONS_COLLECTION].find({"expires_at": {"$gt": datetime.utcnow()}}):
+            revoked[entry["_id"]] = entry["expires_at"]
+        self._revoked = revoked
+
+    def start(self, db: AsyncIOMotorDatabase):
+        self._task = asyncio.create_task(self._poll(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                await self.reload(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Could not reload revoked sessions: {e}")
+            await asyncio.sleep(REVOCATION_POLL_SECONDS)
+
+    def stats(self) -> dict:
+        return {
+            "revoked_sessions": len(self._revoked),
+            "refreshed": self.refreshed,
+            "reuse_detected": self.reuse_detected,
+        }
+
+
+refresh_token_store = RefreshTokenStore()
@@ -0,0 +1,316 @@
+import asyncio
+import bisect
+import logging
+import math
+import os
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from ingredients import recipe_ingredient_keys
+from search import fold
+
+logger = logging.getLogger(__name__)
+
+# Vecinos que se guardan por receta
+RELATED_NEIGHBOURS = int(os.getenv("RELATED_NEIGHBOURS", 12))
+# Similitud mínima para considerar dos recetas relacionadas
+RELATED_MIN_SIMILARITY = float(os.getenv("RELATED_MIN_SIMILARITY", 0.1))
+# Cada cuánto se recalcula la tabla completa (corrige la deriva de los IDF)
+RELATED_REBUILD_SECONDS = float(os.getenv("RELATED_REBUILD_SECONDS", 6 * 3600))
+
+# MinHash de una sola permutación: MINHASH_BINS mínimos agrupados en bandas
+# de MINHASH_ROWS; dos recetas son candidatas si coinciden en alguna banda
+MINHASH_BINS = 16
+MINHASH_ROWS = 2
+# Límites para que los buckets muy poblados no disparen el coste: de cada
+# bucket se miran como mucho MAX_BUCKET_SCAN recetas, a intervalos regulares
+MAX_BUCKET_SCAN = 128
+MAX_CANDIDATES = 48
+# Recetas procesadas entre cada cesión del event loop
+BUILD_CHUNK = 50
+
+# Peso de cada tipo de rasgo antes de aplicar el IDF
+FEATURE_WEIGHTS = {"i": 1.0, "t": 1.0, "c": 0.5}
+
+_MAX_HASH = 2 ** 32
+
+
+def recipe_features(recipe: dict) -> Tuple[str, ...]:
+    """Rasgos de una receta: ingredientes canónicos, etiquetas y categoría."""
+    features = {f"i:{key}" for key in recipe_ingredient_keys(recipe.get("ingredients"))}
+    features.update(f"t:{fold(tag)}" for tag in recipe.get("tags") or [] if isinstance(tag, str))
+    category = recipe.get("category")
+    if category:
+        features.add(f"c:{fold(getattr(category, 'value', category))}")
+    return tuple(sorted(features))
+
+
+def _band_keys(features: Tuple[str, ...]) -> Tuple[int, ...]:
+    # Un solo hash por rasgo repartido en bins; los bins vacíos toman el
+    # valor del siguiente (densificación) para que la firma esté completa
+    bins: List[Optional[int]] = [None] * MINHASH_BINS
+    for feature in features:
+        value = zlib.crc32(feature.encode())
+        index, rest = value % MINHASH_BINS, value // MINHASH_BINS
+        if bins[index] is None or rest < bins[index]:
+            bins[index] = rest
+    if all(value is None for value in bins):
+        return ()
+    for i in range(MINHASH_BINS):
+        offset = 1
+        while bins[i] is None:
+            source = bins[(i + offset) % MINHASH_BINS]
+            if source is not None:
+                bins[i] = source + offset * _MAX_HASH
+            offset += 1
+    return tuple(
+        hash((band, *bins[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]))
+        for band in range(MINHASH_BINS // MINHASH_ROWS)
+    )
+
+
+class _Table:
+    """Rasgos, firmas y vecinos de todas las recetas, con números consecutivos."""
+
+    def __init__(self):
+        self.ordinals: Dict[str, int] = {}
+        self.ids: List[Optional[str]] = []
+        self.features: List[Optional[Tuple[str, ...]]] = []
+        self.signatures: List[Tuple[int, ...]] = []
+        self.buckets: Dict[int, array] = {}
+        self.df: Counter = Counter()
+        # Vector con pesos IDF y su norma, calculados la primera vez que se usan
+        self.vectors: List[Optional[Tuple[Dict[str, float], float]]] = []
+        self.neighbours: List[Optional[array]] = []
+        self.scores: List[Optional[array]] = []
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def add(self, doc_id: str, features: Tuple[str, ...]) -> int:
+        self.remove(doc_id)
+        ordinal = len(self.ids)
+        self.ordinals[doc_id] = ordinal
+        self.ids.append(doc_id)
+        self.features.append(features)
+        self.df.update(features)
+        signature = _band_keys(features)
+        self.signatures.append(signature)
+        for key in signature:
+            # Los números nuevos siempre son los mayores: el array sigue ordenado
+            self.buckets.setdefault(key, array("I")).append(ordinal)
+        self.vectors.append(None)
+        self.neighbours.append(None)
+        self.scores.append(None)
+        return ordinal
+
+    def remove(self, doc_id: str):
+        # Las listas de vecinos de otras recetas que apunten a esta se
+        # limpian al leerlas
+        ordinal = self.ordinals.pop(doc_id, None)
+        if ordinal is None:
+            return
+        self.df.subtract(self.features[ordinal])
+        for key in self.signatures[ordinal]:
+            bucket = self.buckets[key]
+            del bucket[bisect.bisect_left(bucket, ordinal)]
+            if not bucket:
+                del self.buckets[key]
+        self.ids[ordinal] = None
+        self.features[ordinal] = None
+        self.signatures[ordinal] = ()
+        self.vectors[ordinal] = None
+        self.neighbours[ordinal] = None
+        self.scores[ordinal] = None
+
+    def holes(self) -> int:
+        return len(self.ids) - len(self.ordinals)
+
+    def vector(self, ordinal: int) -> Tuple[Dict[str, float], float]:
+        # Los IDF del momento en que se calcula; la reconstrucción periódica
+        # los pone al día
+        vector = self.vectors[ordinal]
+        if vector is None:
+            n_docs = len(self.ordinals) or 1
+            weights = {
+                feature: FEATURE_WEIGHTS[feature[0]] * math.log(1 + n_docs / (self.df[feature] or 1))
+                for feature in self.features[ordinal]
+            }
+            vector = self.vectors[ordinal] = (weights, math.sqrt(sum(w * w for w in weights.values())))
+        return vector
+
+    def similarity(self, ordinal: int, other: int) -> float:
+        weights, norm = self.vector(ordinal)
+        other_weights, other_norm = self.vector(other)
+        if not norm or not other_norm:
+            return 0.0
+        dot = sum(weights[f] * other_weights[f] for f in weights.keys() & other_weights.keys())
+        return dot / (norm * other_norm)
+
+    def compute(self, ordinal: int) -> List[Tuple[float, int]]:
+        """Calcula y guarda los vecinos de una receta."""
+        counts: Counter = Counter()
+        for key in self.signatures[ordinal]:
+            bucket = self.buckets[key]
+            if len(bucket) > MAX_BUCKET_SCAN:
+                # Muestra repartida por todo el bucket, no solo las últimas
+                # recetas; cada receta empieza en un punto distinto
+                step = math.ceil(len(bucket) / MAX_BUCKET_SCAN)
+                bucket = bucket[ordinal % step::step]
+            counts.update(bucket)
+        counts.pop(ordinal, None)
+
+        scored = []
+        for other, _ in counts.most_common(MAX_CANDIDATES):
+            score = self.similarity(ordinal, other)
+            if score >= RELATED_MIN_SIMILARITY:
+                scored.append((score, other))
+        scored.sort(key=lambda item: (-item[0], item[1]))
+        scored = scored[:RELATED_NEIGHBOURS]
+        self.neighbours[ordinal] = array("I", (other for _, other in scored))
+        self.scores[ordinal] = array("f", (score for score, _ in scored))
+        return scored
+
+    def offer(self, ordinal: int, other: int, score: float):
+        """Añade other a los vecinos ya calculados de ordinal si mejora la lista."""
+        neighbours, scores = self.neighbours[ordinal], self.scores[ordinal]
+        if neighbours is None:
+            return
+        if len(neighbours) >= RELATED_NEIGHBOURS and score <= scores[-1]:
+            return
+        position = 0
+        while position < len(scores) and scores[position] >= score:
+            position += 1
+        neighbours.insert(position, other)
+        scores.insert(position, score)
+        del neighbours[RELATED_NEIGHBOURS:]
+        del scores[RELATED_NEIGHBOURS:]
+
+
+class RelatedIndex:
+    """Tabla de recetas relacionadas por ingredientes, etiquetas y categoría.
+
+    La tabla se calcula en segundo plano al arrancar y periódicamente, con
+    candidatas de MinHash/LSH puntuadas por similitud del coseno con pesos
+    IDF. Las escrituras la actualizan al momento: la receta nueva o
+    modificada calcula sus vecinos y se ofrece a los de sus candidatas.
+    """
+
+    def __init__(self):
+        self._table = _Table()
+        # Escrituras que llegan mientras se carga una tabla nueva: (id, receta
+        # o None si se ha borrado)
+        self._pending: Optional[List[Tuple[str, Optional[dict]]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._rebuild_requested = asyncio.Event()
+        # False hasta que se carga la primera tabla: antes, que una receta no
+        # esté no quiere decir que no exista
+        self.ready = False
+
+    def __len__(self):
+        return len(self._table)
+
+    def start(self, db: AsyncIOMotorDatabase):
+        self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self, db: AsyncIOMotorDatabase):
+        while True:
+            try:
+                await self.build(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Could not build related recipes table: {e}")
+            self._rebuild_requested.clear()
+            try:
+                await asyncio.wait_for(self._rebuild_requested.wait(), RELATED_REBUILD_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        table = _Table()
+        self._pending = []
+        try:
+            loaded = 0
+            async for recipe in db.recetas.find({}, {"ingredients": 1, "tags": 1, "category": 1}):
+                table.add(str(recipe["_id"]), recipe_features(recipe))
+                loaded += 1
+                if loaded % BUILD_CHUNK == 0:
+                    await asyncio.sleep(0)
+            for doc_id, recipe in self._pending:
+                if recipe is None:
+                    table.remove(doc_id)
+                else:
+                    table.add(doc_id, recipe_features(recipe))
+        finally:
+            self._pending = None
+        self._table = table
+        self.ready = True
+
+        # Vecinos de todas las recetas, cediendo el event loop entre lotes.
+        # Las que se pidan antes de llegar a ellas se calculan al momento.
+        for ordinal in range(len(table.ids)):
+            if table is not self._table:
+                return
+            if table.ids[ordinal] is not None and table.neighbours[ordinal] is None:
+                table.compute(ordinal)
+            if ordinal % BUILD_CHUNK == 0:
+                await asyncio.sleep(0)
+        logger.info(f"Related recipes table built for {len(table)} recipes")
+
+    def add(self, recipe: dict):
+        doc_id = str(recipe["_id"])
+        if self._pending is not None:
+            self._pending.append((doc_id, recipe))
+        table = self._table
+        ordinal = table.add(doc_id, recipe_features(recipe))
+        for score, other in table.compute(ordinal):
+            table.offer(other, ordinal, score)
+        if table.holes() > len(table) + BUILD_CHUNK:
+            # Demasiados huecos en la numeración tras muchas ediciones
+            self.request_rebuild()
+
+    def request_rebuild(self):
+        self._rebuild_requested.set()
+
+    def remove(self, doc_id: str):
+        if self._pending is not None:
+            self._pending.append((doc_id, None))
+        self._table.remove(doc_id)
+
+    def update_many(self, recipes: List[dict]):
+        for recipe in recipes:
+            self.add(recipe)
+
+    def related(self, doc_id: str, limit: int = RELATED_NEIGHBOURS) -> Optional[List[Tuple[str, float]]]:
+        """Recetas relacionadas (id, similitud), o None si la receta no está en la tabla."""
+        table = self._table
+        ordinal = table.ordinals.get(doc_id)
+        if ordinal is None:
+            return None
+        if table.neighbours[ordinal] is None:
+            table.compute(ordinal)
+        result = []
+        for other, score in zip(table.neighbours[ordinal], table.scores[ordinal]):
+            other_id = table.ids[other]
+            if other_id is not None:
+                result.append((other_id, round(score, 4)))
+            if len(result) == limit:
+                break
+        return result
+
+
+related_index = RelatedIndex()
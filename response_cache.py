@@ -0,0 +1,133 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from fastapi import Request, Response
+
+# Tamaño máximo de la caché (suma de los cuerpos de las respuestas)
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+# Las escrituras de otros workers no invalidan esta caché, así que las
+# entradas caducan pasado este tiempo
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 5))
+
+# Cabeceras de la respuesta original que no se guardan
+_SKIPPED_HEADERS = {"content-length", "content-type", "etag", "cache-control"}
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    status_code: int
+    media_type: Optional[str]
+    headers: Dict[str, str]
+    etag: str
+    expires_at: float
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return etag in candidates or f"W/{etag}" in candidates
+
+
+class ResponseCache:
+    """Caché LRU en memoria de respuestas GET, limitada por tamaño.
+
+    Las entradas se identifican por ruta y parámetros de consulta y llevan un
+    ETag fuerte calculado a partir del cuerpo (o el que indique el endpoint,
+    como la versión de la receta), de modo que todos los workers generan el
+    mismo ETag para el mismo contenido y los clientes pueden revalidar con
+    If-None-Match.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.not_modified = 0
+
+    @staticmethod
+    def key_for(request: Request) -> str:
+        # Orden estable por nombre: los valores repetidos (ids=B&ids=A)
+        # conservan su orden, que en /recipes/batch es el de la respuesta
+        items = sorted(request.query_params.multi_items(), key=lambda item: item[0])
+        query = "&".join(f"{k}={v}" for k, v in items)
+        return f"{request.url.path}?{query}"
+
+    def get(self, request: Request) -> Optional[Response]:
+        key = self.key_for(request)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at < time.monotonic():
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._respond(request, entry)
+
+    def put(self, request: Request, response: Response, etag: Optional[str] = None) -> Response:
+        body = response.body
+        entry = CachedResponse(
+            body=body,
+            status_code=response.status_code,
+            media_type=response.media_type,
+            headers={k: v for k, v in response.headers.items() if k not in _SKIPPED_HEADERS},
+            etag=etag or '"%s"' % hashlib.sha256(body).hexdigest()[:32],
+            expires_at=time.monotonic() + self.ttl,
+        )
+        if len(body) <= self.max_bytes:
+            key = self.key_for(request)
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+        return self._respond(request, entry)
+
+    def invalidate(self):
+        self._entries.clear()
+        self._size = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "not_modified": self.not_modified,
+            "entries": len(self._entries),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
+
+    def _respond(self, request: Request, entry: CachedResponse) -> Response:
+        headers = {**entry.headers, "ETag": entry.etag, "Cache-Control": "no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), entry.etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(
+            content=entry.body,
+            status_code=entry.status_code,
+            headers=headers,
+            media_type=entry.media_type,
+        )
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,155 @@
+import logging
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada campo de RecipeBase en la puntuación
+FIELD_WEIGHTS = {
+    "title": 3.0,
+    "tags": 2.0,
+    "description": 1.5,
+    "ingredients": 1.0,
+    "comment": 0.5,
+}
+
+# Proyección con los campos necesarios para indexar una receta
+SEARCH_PROJECTION = {field: 1 for field in FIELD_WEIGHTS}
+
+# Parámetros de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "al", "con", "de", "del", "e", "el", "en", "la", "las", "lo", "los",
+    "o", "para", "por", "que", "se", "sin", "su", "sus", "u", "un", "una",
+    "unas", "unos", "y",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text: str) -> str:
+    # Minúsculas y sin acentos: "Champiñón" -> "champinon"
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def stem(token: str) -> str:
+    """Stemming ligero para español: plurales y género.
+
+    "tomates" -> "tomat", "tomate" -> "tomat", "fritas" -> "frit".
+    """
+    if len(token) > 4 and token.endswith("ces"):
+        token = token[:-3] + "z"
+    elif len(token) > 4 and token.endswith("es") and token[-3] not in "aeiou":
+        token = token[:-2]
+    elif len(token) > 3 and token.endswith("s"):
+        token = token[:-1]
+    if len(token) > 4 and token[-1] in "aeo":
+        token = token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    return [
+        stem(token)
+        for token in _TOKEN_RE.findall(fold(text))
+        if token not in STOPWORDS
+    ]
+
+
+def _field_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    return " ".join(str(item) for item in value)
+
+
+class SearchIndex:
+    """Índice invertido en memoria sobre los campos de texto de las recetas.
+
+    Guarda por cada término la frecuencia ponderada en cada receta y puntúa
+    las consultas con BM25.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._doc_lengths: Dict[str, float] = {}
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    async def build(self, db: AsyncIOMotorDatabase):
+        self.clear()
+        async for recipe in db.recetas.find({}, SEARCH_PROJECTION):
+            self.add(recipe)
+        logger.info(f"Search index built with {len(self)} recipes and {len(self._postings)} terms")
+
+    def clear(self):
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_lengths.clear()
+        self._total_length = 0.0
+
+    def add(self, recipe: dict):
+        doc_id = str(recipe.get("_id", recipe.get("id")))
+        self.remove(doc_id)
+
+        terms: Dict[str, float] = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(_field_text(recipe.get(field))):
+                terms[token] += weight
+        length = sum(terms.values())
+
+        for term, tf in terms.items():
+            self._postings[term][doc_id] = tf
+        self._doc_terms[doc_id] = dict(terms)
+        self._doc_lengths[doc_id] = length
+        self._total_length += length
+
+    def remove(self, doc_id: str):
+        terms = self._doc_terms.pop(doc_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(doc_id, 0.0)
+
+    def search(self, query: str, limit: Optional[int] = 20) -> List[Tuple[str, float]]:
+        n_docs = len(self._doc_terms)
+        if n_docs == 0:
+            return []
+        avg_length = self._total_length / n_docs or 1.0
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit] if limit else ranked
+
+    def update_many(self, recipes: Iterable[dict]):
+        for recipe in recipes:
+            self.add(recipe)
+
+
+search_index = SearchIndex()
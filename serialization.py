@@ -0,0 +1,114 @@
+import os
+from collections import OrderedDict
+from typing import Iterable, Optional, Type
+
+import orjson
+from bson import ObjectId
+from pydantic import BaseModel
+from pydantic_core import PydanticUndefined
+
+from backfill import recipe_backfill, recipe_fix
+from image_variants import variant_urls
+from models.recipe import Metadata, Recipe, RecipeCard, RecipeView
+
+# Número de recetas cuyo JSON se guarda ya codificado
+RECIPE_JSON_CACHE_SIZE = int(os.getenv("RECIPE_JSON_CACHE_SIZE", 20000))
+
+VIEW_MODELS = {
+    RecipeView.FULL: Recipe,
+    RecipeView.CARD: RecipeCard,
+}
+
+
+def prepare_recipe(recipe: dict) -> dict:
+    # Las recetas antiguas las completa backfill.py en segundo plano; hasta
+    # que termine, las que aún no ha tocado se completan al leerlas. Después
+    # solo las que se saltó (sin metadata), que se completarán al editarlas
+    if isinstance(recipe.get("_id"), ObjectId) and (
+        not recipe_backfill.done or not isinstance(recipe.get("metadata"), dict)
+    ):
+        recipe.update(recipe_fix(recipe) or {})
+    recipe["id"] = str(recipe.pop("_id"))
+    recipe["image_variants"] = variant_urls(recipe.get("image_path"))
+    return recipe
+
+
+def _defaults(model: Type[BaseModel]) -> dict:
+    return {
+        name: None if field.default is PydanticUndefined else field.default
+        for name, field in model.model_fields.items()
+    }
+
+
+_VIEW_DEFAULTS = {view: _defaults(model) for view, model in VIEW_MODELS.items()}
+_METADATA_DEFAULTS = _defaults(Metadata)
+
+
+def recipe_payload(recipe: dict, view: RecipeView = RecipeView.FULL) -> dict:
+    """Diccionario listo para JSON de una receta leída de db.recetas.
+
+    Los documentos de la colección solo los escribe esta aplicación, ya
+    validados, así que no se vuelven a pasar por Pydantic: solo se eligen los
+    campos del modelo de la vista, en su orden.
+    """
+    recipe = prepare_recipe(dict(recipe))
+    payload = {name: recipe.get(name, default) for name, default in _VIEW_DEFAULTS[view].items()}
+    if payload.get("tags") is not None:
+        payload["tags"] = list(payload["tags"])
+    metadata = payload.get("metadata")
+    if metadata is not None:
+        payload["metadata"] = {name: metadata.get(name, default) for name, default in _METADATA_DEFAULTS.items()}
+    return payload
+
+
+class RecipeEncoder:
+    """JSON de las recetas, con caché de bytes por receta y versión.
+
+    La clave incluye updated_at y la versión, que cambian en cada escritura,
+    así que una entrada nunca queda obsoleta, tampoco entre workers. Los
+    listados se montan concatenando los bytes de cada receta.
+    """
+
+    def __init__(self, max_entries: int = RECIPE_JSON_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(recipe: dict, view: RecipeView) -> Optional[tuple]:
+        metadata = recipe.get("metadata")
+        if not metadata or not metadata.get("updated_at"):
+            # Receta antigua pendiente del backfill: no se guarda
+            return None
+        return recipe["_id"], metadata["updated_at"], metadata.get("version"), view
+
+    def encode(self, recipe: dict, view: RecipeView = RecipeView.FULL) -> bytes:
+        key = self._key(recipe, view)
+        if key is not None:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return data
+        self.misses += 1
+        data = orjson.dumps(recipe_payload(recipe, view))
+        if key is not None:
+            self._cache[key] = data
+            if len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return data
+
+    def encode_list(self, recipes: Iterable[dict], view: RecipeView = RecipeView.FULL) -> bytes:
+        return b"[" + b",".join(self.encode(recipe, view) for recipe in recipes) + b"]"
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._cache),
+            "max_entries": self.max_entries,
+        }
+
+
+recipe_encoder = RecipeEncoder()
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+
+logger = logging.getLogger(__name__)
+
+# Colección con el número de recetas que usa cada etiqueta ({_id: tag, count: n})
+TAG_COUNTS_COLLECTION = "tag_counts"
+
+# Cada cuánto se relee la colección para ver los cambios de otros workers
+CACHE_TTL_SECONDS = 30
+
+
+class TagIndex:
+    """Índice etiqueta -> número de recetas, persistido en Mongo.
+
+    Los endpoints de escritura lo actualizan de forma incremental y cada
+    proceso mantiene una copia en memoria desde la que se sirve /tags/.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._counts: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def rebuild(self, db: AsyncIOMotorDatabase):
+        # Recalcula todo el índice desde las recetas; $out sustituye la
+        # colección de forma atómica
+        await db.recetas.aggregate([
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+            {"$out": TAG_COUNTS_COLLECTION},
+        ]).to_list(length=None)
+        await self.reload(db)
+        logger.info(f"Tag index rebuilt with {len(self._counts)} tags")
+
+    async def reload(self, db: AsyncIOMotorDatabase):
+        counts = {}
+        async for entry in db[TAG_COUNTS_COLLECTION].find({"count": {"$gt": 0}}):
+            counts[entry["_id"]] = entry["count"]
+        self._counts = counts
+        self._loaded_at = time.monotonic()
+
+    async def apply_change(
+        self,
+        db: AsyncIOMotorDatabase,
+        old_tags: Optional[Iterable[str]],
+        new_tags: Optional[Iterable[str]],
+    ):
+        old = set(old_tags or [])
+        new = set(new_tags or [])
+        deltas = {tag: 1 for tag in new - old}
+        deltas.update({tag: -1 for tag in old - new})
+        if not deltas:
+            return
+
+        await db[TAG_COUNTS_COLLECTION].bulk_write(
+            [UpdateOne({"_id": tag}, {"$inc": {"count": delta}}, upsert=True)
+             for tag, delta in deltas.items()],
+            ordered=False,
+        )
+        removed = [tag for tag, delta in deltas.items() if delta < 0]
+        if removed:
+            await db[TAG_COUNTS_COLLECTION].delete_many(
+                {"_id": {"$in": removed}, "count": {"$lte": 0}}
+            )
+
+        for tag, delta in deltas.items():
+            count = self._counts.get(tag, 0) + delta
+            if count > 0:
+                self._counts[tag] = count
+            else:
+                self._counts.pop(tag, None)
+
+    async def get_counts(self, db: AsyncIOMotorDatabase) -> List[tuple]:
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            async with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                    await self.reload(db)
+        return sorted(self._counts.items())
+
+
+tag_index = TagIndex()
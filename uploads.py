@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Optional
+
+import aiofiles
+import cloudinary.uploader
+from fastapi import HTTPException, UploadFile, status
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from image_variants import image_variants
+
+logger = logging.getLogger(__name__)
+
+# Límites de las subidas
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 10 * 1024 * 1024))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Subidas simultáneas al almacenamiento remoto
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", 4))
+# Una subida pendiente cuyo turno no se renueva en este tiempo se da por
+# abandonada (proceso reiniciado o caído) y se vuelve a subir. Mientras la
+# subida sigue en marcha se renueva cada tercio de este tiempo
+UPLOAD_LEASE_SECONDS = int(os.getenv("UPLOAD_LEASE_SECONDS", 300))
+# Cada cuánto se mira una subida que está haciendo otro worker
+UPLOAD_POLL_SECONDS = 0.5
+# Directorio donde se guardan las subidas mientras se procesan
+UPLOAD_SPOOL_DIR = Path(os.getenv("UPLOAD_SPOOL_DIR", "uploads"))
+# "cloudinary" en producción, "local" para desarrollo y pruebas
+IMAGE_STORAGE = os.getenv("IMAGE_STORAGE", "cloudinary")
+
+# Colección con una entrada por imagen, identificada por el hash del contenido
+IMAGES_COLLECTION = "images"
+
+ALLOWED_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif"}
+
+
+class CloudinaryStorage:
+    def store(self, path: Path, image_id: str) -> str:
+        result = cloudinary.uploader.upload(str(path), public_id=image_id, overwrite=False)
+        return result["secure_url"]
+
+
+class LocalStorage:
+    """Guarda las imágenes en public/images/recipes, servidas por /images."""
+
+    def __init__(self, directory: Path = Path("public/images/recipes"), url_prefix: str = "/images/recipes"):
+        self.directory = directory
+        self.url_prefix = url_prefix
+
+    def store(self, path: Path, image_id: str) -> str:
+        name = f"{image_id}{path.suffix}"
+        self.directory.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, self.directory / name)
+        return f"{self.url_prefix}/{name}"
+
+
+STORAGE_BACKENDS = {
+    "cloudinary": CloudinaryStorage,
+    "local": LocalStorage,
+}
+
+
+class UploadPipeline:
+    """Subida de imágenes sin bloquear el event loop.
+
+    El fichero se vuelca a disco por trozos calculando su SHA-256, que sirve
+    de identificador: una imagen ya subida no se vuelve a subir. El envío al
+    almacenamiento se hace en hilos aparte con concurrencia limitada y puede
+    esperarse o dejarse en segundo plano. Una subida pendiente que nadie
+    termina en UPLOAD_LEASE_SECONDS se vuelve a subir al repetirla.
+    """
+
+    def __init__(
+        self,
+        storage,
+        spool_dir: Path = UPLOAD_SPOOL_DIR,
+        max_bytes: int = UPLOAD_MAX_BYTES,
+        concurrency: int = UPLOAD_CONCURRENCY,
+    ):
+        self.storage = storage
+        self.spool_dir = spool_dir
+        self.max_bytes = max_bytes
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def spool(self, file: UploadFile) -> tuple:
+        suffix = Path(file.filename or "").suffix.lower()
+        if suffix not in ALLOWED_SUFFIXES:
+            suffix = ".jpg"
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spool_dir / f"{uuid.uuid4().hex}{suffix}"
+
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async with aiofiles.open(path, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise HTTPException(
+                            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"La imagen supera el tamaño máximo de {self.max_bytes} bytes"
+                        )
+                    digest.update(chunk)
+                    await out.write(chunk)
+        except BaseException:
+            path.unlink(missing_ok=True)
+            raise
+        return path, digest.hexdigest(), size
+
+    def _abandoned(self, record: dict) -> bool:
+        if record["status"] != "pending" or record["_id"] in self._inflight:
+            return False
+        lease_until = record.get("lease_until") or record["created_at"] + timedelta(seconds=UPLOAD_LEASE_SECONDS)
+        return lease_until < datetime.utcnow()
+
+    async def _wait(self, db: AsyncIOMotorDatabase, record: dict) -> dict:
+        # Espera a que termine la subida, aquí o en otro worker
+        task = self._inflight.get(record["_id"])
+        if task is not None:
+            await asyncio.shield(task)
+            return await db[IMAGES_COLLECTION].find_one({"_id": record["_id"]})
+        while record["status"] == "pending" and not self._abandoned(record):
+            await asyncio.sleep(UPLOAD_POLL_SECONDS)
+            record = await db[IMAGES_COLLECTION].find_one({"_id": record["_id"]})
+        return record
+
+    async def submit(self, db: AsyncIOMotorDatabase, file: UploadFile, wait: bool = True) -> dict:
+        path, image_id, size = await self.spool(file)
+
+        existing = await db[IMAGES_COLLECTION].find_one({"_id": image_id})
+        if existing is not None and wait and existing["status"] == "pending":
+            existing = await self._wait(db, existing)
+        if existing is not None and existing["status"] != "failed" and not self._abandoned(existing):
+            # Imagen repetida: no se guarda ni se sube otra vez
+            path.unlink(missing_ok=True)
+            return self._describe(existing)
+
+        now = datetime.utcnow()
+        record = {
+            "_id": image_id,
+            "status": "pending",
+            "size": size,
+            "url": None,
+            "error": None,
+            "created_at": now,
+            "lease_until": now + timedelta(seconds=UPLOAD_LEASE_SECONDS),
+        }
+        try:
+            if existing is None:
+                await db[IMAGES_COLLECTION].insert_one(record)
+            else:
+                # Fallida o abandonada: solo si nadie la ha retomado ya
+                result = await db[IMAGES_COLLECTION].replace_one(
+                    {"_id": image_id, "status": existing["status"], "lease_until": existing.get("lease_until")},
+                    record
+                )
+                if result.matched_count == 0:
+                    path.unlink(missing_ok=True)
+                    return self._describe(await db[IMAGES_COLLECTION].find_one({"_id": image_id}))
+        except DuplicateKeyError:
+            # Otra petición ha subido la misma imagen a la vez
+            path.unlink(missing_ok=True)
+            return self._describe(await db[IMAGES_COLLECTION].find_one({"_id": image_id}))
+
+        task = asyncio.create_task(self._push(db, image_id, path))
+        self._inflight[image_id] = task
+        task.add_done_callback(lambda _: self._inflight.pop(image_id, None))
+        if wait:
+            await asyncio.shield(task)
+            return await self.status(db, image_id)
+        return self._describe(record)
+
+    async def _renew_lease(self, db: AsyncIOMotorDatabase, image_id: str):
+        # Las subidas lentas (o en cola del semáforo) no deben parecer abandonadas
+        while True:
+            await asyncio.sleep(UPLOAD_LEASE_SECONDS / 3)
+            try:
+                await db[IMAGES_COLLECTION].update_one(
+                    {"_id": image_id, "status": "pending"},
+                    {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=UPLOAD_LEASE_SECONDS)}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew upload lease for {image_id}: {e}")
+
+    async def _push(self, db: AsyncIOMotorDatabase, image_id: str, path: Path):
+        heartbeat = asyncio.create_task(self._renew_lease(db, image_id))
+        try:
+            async with self._semaphore:
+                url = await asyncio.to_thread(self.storage.store, path, image_id)
+            await db[IMAGES_COLLECTION].update_one(
+                {"_id": image_id},
+                {"$set": {"status": "done", "url": url, "completed_at": datetime.utcnow()}}
+            )
+            if isinstance(self.storage, LocalStorage):
+                # Miniaturas y demás tamaños, en segundo plano
+                image_variants.schedule(self.storage.directory / f"{image_id}{path.suffix}")
+        except Exception as e:
+            logger.error(f"Error uploading image {image_id}: {e}")
+            await db[IMAGES_COLLECTION].update_one(
+                {"_id": image_id},
+                {"$set": {"status": "failed", "error": str(e)}}
+            )
+        finally:
+            heartbeat.cancel()
+            path.unlink(missing_ok=True)
+
+    async def status(self, db: AsyncIOMotorDatabase, image_id: str) -> Optional[dict]:
+        record = await db[IMAGES_COLLECTION].find_one({"_id": image_id})
+        return self._describe(record) if record else None
+
+    @staticmethod
+    def _describe(record: dict) -> dict:
+        return {
+            "id": record["_id"],
+            "status": record["status"],
+            "url": record.get("url"),
+            "error": record.get("error"),
+        }
+
+
+upload_pipeline = UploadPipeline(STORAGE_BACKENDS[IMAGE_STORAGE]())
@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import HTTPException, status
+
+
+def metadata_now() -> datetime:
+    # Mongo guarda las fechas con milisegundos: el worker que escribe debe
+    # tener en memoria la misma fecha que leerán los demás de la base de datos
+    now = datetime.utcnow()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def recipe_version(recipe: dict) -> int:
+    # Las recetas anteriores al contador de versiones cuentan como versión 0
+    return (recipe.get("metadata") or {}).get("version") or 0
+
+
+def recipe_etag(recipe: dict) -> str:
+    recipe_id = recipe.get("_id", recipe.get("id"))
+    return f'"{recipe_id}-{recipe_version(recipe)}"'
+
+
+def version_filter(version: int) -> dict:
+    if version == 0:
+        return {"metadata.version": {"$in": [0, None]}}
+    return {"metadata.version": version}
+
+
+def expected_version(if_match: Optional[str], recipe_id: str) -> Optional[int]:
+    """Versión exigida por la cabecera If-Match, o None si no hay condición.
+
+    Un ETag de otra receta o con formato desconocido nunca puede coincidir,
+    así que se responde 412 directamente.
+    """
+    if not if_match or if_match.strip() == "*":
+        return None
+    precondition_failed = HTTPException(
+        status_code=status.HTTP_412_PRECONDITION_FAILED,
+        detail="La receta ha sido modificada por otra persona"
+    )
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            # If-Match exige comparación fuerte
+            continue
+        etag_id, _, version = tag.strip('"').rpartition("-")
+        if etag_id == recipe_id and version.isdigit():
+            return int(version)
+    raise precondition_failed